@@ -174,6 +174,7 @@ def build_executable():
         'qt_material',
         'telethon',
         'tweepy',
+        'PIL',
         'sqlite3',
         'utils.common',
         'core',
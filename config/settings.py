@@ -8,6 +8,10 @@ from models.database import DatabaseManager
 @dataclass
 class DatabaseConfig:
     db_file: str = "forward.db"
+    log_retention_days: int = 30  # 转发日志在主库中保留的天数，更早的移入月度归档库
+    backup_interval_hours: int = 24  # 自动备份的间隔
+    backup_keep: int = 7  # 保留的备份份数
+    backup_compress: bool = True  # 是否以gzip压缩备份文件
     
 @dataclass
 class AppConfig:
@@ -15,6 +19,11 @@ class AppConfig:
     version: str = "1.0.0"
     data_dir: str = os.path.expanduser("~/.tg_forward")
     log_file: str = "forward.log"
+    media_budget_mb: int = 512  # 同时在下载、缓冲和上传中的媒体总大小上限
+    media_cache_mb: int = 2048  # 磁盘媒体缓存的容量上限，为 0 时不缓存
+    telegram_idle_timeout: int = 1800  # Telegram连接空闲超过该秒数后断开，为 0 时不断开
+    telegram_memory_sessions: bool = False  # 会话状态保存在内存中，定期写入快照文件
+    telegram_session_save_interval: int = 60  # 内存会话写入快照的间隔（秒）
     database: DatabaseConfig = DatabaseConfig()
     
     def __post_init__(self):
@@ -88,31 +97,17 @@ class Settings:
         
     def get_forward_rules(self) -> List[Dict]:
         """获取所有转发规则"""
-        rules = self.db.get_rules()
-        result = []
-        for rule in rules:
-            source_group = self.db.get_group_by_id(rule.source_group_id)
-            target_group = self.db.get_group_by_id(rule.target_id)
-            
-            if source_group and target_group:
-                result.append({
-                    'name': rule.name,
-                    'source_group': {
-                        'id': source_group.group_id,
-                        'title': source_group.title,
-                        'type': source_group.group_type
-                    },
-                    'target_type': rule.target_type,
-                    'target': {
-                        'id': target_group.group_id,
-                        'title': target_group.title
-                    },
-                    'filters': rule.filters,
-                    'options': rule.options,
-                    'twitter_config': rule.twitter_config,
-                    'disabled': not rule.is_enabled
-                })
-        return result
+        return [{
+            'id': view['rule'].id,
+            'name': view['rule'].name,
+            'source_group': view['source_group'],
+            'target_type': view['rule'].target_type,
+            'target': view['target'],
+            'filters': view['rule'].filters,
+            'options': view['rule'].options,
+            'twitter_config': view['rule'].twitter_config,
+            'disabled': not view['rule'].is_enabled
+        } for view in self.db.get_rule_views()]
         
     def get_statistics(self, start_date: Optional[str] = None,
                       end_date: Optional[str] = None) -> Dict:
@@ -136,7 +131,22 @@ class Settings:
         return self.db.get_forward_logs(
             rule_id=rule_id,
             start_date=start_date,
-            end_date=end_date
+            end_date=end_date,
+            include_archive=True
+        )
+        
+    def prune_forward_logs(self) -> int:
+        """按保留策略归档过期的转发日志"""
+        return self.db.prune_forward_logs(
+            retention_days=self.config.database.log_retention_days
+        )
+        
+    def backup_database(self) -> Optional[str]:
+        """按备份策略执行自动备份"""
+        return self.db.run_scheduled_backup(
+            interval_hours=self.config.database.backup_interval_hours,
+            keep=self.config.database.backup_keep,
+            compress=self.config.database.backup_compress
         )
         
 # 创建全局设置实例
@@ -0,0 +1,199 @@
+# core/export.py
+
+import csv
+import json
+import logging
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+class ExportCancelled(Exception):
+    """导出被用户取消"""
+
+class DataExporter:
+    """分块流式导出转发日志和统计数据
+    
+    数据逐块从数据库读取并写入文件，内存占用与导出行数无关。
+    先写入临时文件，完成后再替换为目标文件，取消或失败时不会留下残缺文件。
+    """
+    FORMATS = {
+        'csv': 'CSV (*.csv)',
+        'jsonl': 'JSON Lines (*.jsonl)',
+        'parquet': 'Parquet (*.parquet)',
+    }
+    
+    LOG_FIELDS = (
+        ('id', 'int'),
+        ('created_at', 'str'),
+        ('rule_id', 'int'),
+        ('rule_name', 'str'),
+        ('status', 'str'),
+        ('message_text', 'str'),
+        ('error_message', 'str'),
+    )
+    
+    STATISTICS_FIELDS = (
+        ('date', 'str'),
+        ('rule_id', 'int'),
+        ('rule_name', 'str'),
+        ('total_messages', 'int'),
+        ('success_messages', 'int'),
+        ('avg_delay', 'float'),
+    )
+    
+    def __init__(self, chunk_size: int = 5000):
+        self.chunk_size = chunk_size
+        self._cancelled = threading.Event()
+        
+    @classmethod
+    def available_formats(cls) -> Dict[str, str]:
+        """当前环境可用的导出格式，Parquet 需要安装 pyarrow"""
+        formats = dict(cls.FORMATS)
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            formats.pop('parquet')
+        return formats
+        
+    def cancel(self):
+        """取消正在进行的导出"""
+        self._cancelled.set()
+        
+    def export_logs(self, path: str, fmt: str, rule_id: int = None,
+                    start_date: str = None, end_date: str = None,
+                    progress_callback: Optional[Callable[[int, int], None]] = None) -> int:
+        """导出转发日志（包含归档数据），返回导出的行数"""
+        total = settings.db.count_forward_logs(
+            rule_id=rule_id,
+            start_date=start_date,
+            end_date=end_date,
+            include_archive=True
+        )['total']
+        
+        chunks = (
+            [self._log_to_row(log) for log in logs]
+            for logs in settings.db.iter_forward_logs(
+                rule_id=rule_id,
+                start_date=start_date,
+                end_date=end_date,
+                include_archive=True,
+                chunk_size=self.chunk_size
+            )
+        )
+        return self._write(path, fmt, self.LOG_FIELDS, chunks, total, progress_callback)
+        
+    def export_statistics(self, path: str, fmt: str,
+                          start_date: str = None, end_date: str = None,
+                          progress_callback: Optional[Callable[[int, int], None]] = None) -> int:
+        """导出每日统计数据，返回导出的行数"""
+        stats = settings.db.get_statistics(start_date=start_date, end_date=end_date)
+        rows = [self._statistics_to_row(stat) for stat in stats]
+        chunks = (
+            rows[i:i + self.chunk_size]
+            for i in range(0, len(rows), self.chunk_size)
+        )
+        return self._write(path, fmt, self.STATISTICS_FIELDS, chunks, len(rows), progress_callback)
+        
+    def _log_to_row(self, log) -> tuple:
+        rule = settings.db.get_rule_by_id(log.rule_id)
+        return (
+            log.id,
+            log.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            log.rule_id,
+            rule.name if rule else None,
+            log.status,
+            log.message_text,
+            log.error_message,
+        )
+        
+    def _statistics_to_row(self, stat: Dict) -> tuple:
+        rule = settings.db.get_rule_by_id(stat['rule_id'])
+        return (
+            str(stat['date']),
+            stat['rule_id'],
+            rule.name if rule else None,
+            stat['total_messages'],
+            stat['success_messages'],
+            stat['avg_delay'],
+        )
+        
+    def _write(self, path: str, fmt: str, fields: Sequence[tuple],
+               chunks: Iterable[List[tuple]], total: int,
+               progress_callback: Optional[Callable[[int, int], None]]) -> int:
+        """将数据块写入临时文件，完成后原子替换为目标文件"""
+        writers = {
+            'csv': self._write_csv,
+            'jsonl': self._write_jsonl,
+            'parquet': self._write_parquet,
+        }
+        if fmt not in writers:
+            raise ValueError(f"不支持的导出格式: {fmt}")
+            
+        self._cancelled.clear()
+        tmp_path = f"{path}.part"
+        try:
+            count = writers[fmt](tmp_path, fields, self._track(chunks, total, progress_callback))
+            os.replace(tmp_path, path)
+            logger.info(f"已导出 {count} 行数据到 {path}")
+            return count
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+            
+    def _track(self, chunks: Iterable[List[tuple]], total: int,
+               progress_callback: Optional[Callable[[int, int], None]]):
+        """在数据块之间检查取消标志并报告进度"""
+        done = 0
+        for chunk in chunks:
+            if self._cancelled.is_set():
+                raise ExportCancelled()
+            yield chunk
+            done += len(chunk)
+            if progress_callback:
+                progress_callback(done, max(total, done))
+                
+    def _write_csv(self, path: str, fields: Sequence[tuple], chunks) -> int:
+        count = 0
+        # 使用带BOM的UTF-8，便于Excel正确识别中文
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow([name for name, _ in fields])
+            for chunk in chunks:
+                writer.writerows(chunk)
+                count += len(chunk)
+        return count
+        
+    def _write_jsonl(self, path: str, fields: Sequence[tuple], chunks) -> int:
+        count = 0
+        names = [name for name, _ in fields]
+        with open(path, 'w', encoding='utf-8') as f:
+            for chunk in chunks:
+                f.writelines(
+                    json.dumps(dict(zip(names, row)), ensure_ascii=False) + '\n'
+                    for row in chunk
+                )
+                count += len(chunk)
+        return count
+        
+    def _write_parquet(self, path: str, fields: Sequence[tuple], chunks) -> int:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("导出Parquet需要安装pyarrow")
+            
+        types = {'int': pa.int64(), 'float': pa.float64(), 'str': pa.string()}
+        schema = pa.schema([(name, types[kind]) for name, kind in fields])
+        
+        count = 0
+        # 每个数据块写为一个行组，避免在内存中拼接整张表
+        with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+            for chunk in chunks:
+                columns = [list(column) for column in zip(*chunk)] if chunk else [[] for _ in fields]
+                writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+                count += len(chunk)
+        return count
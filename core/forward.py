@@ -2,13 +2,17 @@
 
 import asyncio
 import logging
+import os
 import re
+import tempfile
 from datetime import datetime
 from typing import List, Dict, Optional
 from telethon import events
+from telethon.errors import ChannelInvalidError, ChannelPrivateError, PeerIdInvalidError
 from config.settings import settings
 from .telegram import TelegramManager
-from .twitter import TwitterManager
+from .twitter import TwitterManager, TweetMedia
+from .media import ByteBudget, MediaCache
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +20,16 @@ class ForwardEngine:
     def __init__(self):
         self.telegram = TelegramManager()
         self.twitter = TwitterManager()
+        # 所有媒体下载、缓冲和上传共用的字节预算
+        self.media_budget = ByteBudget(settings.config.media_budget_mb * 1024 * 1024)
+        self.telegram.media_budget = self.media_budget
+        # 按内容寻址的磁盘媒体缓存，重复的媒体不再重新下载
+        self.media_cache = MediaCache(
+            settings.db,
+            os.path.join(settings.config.data_dir, 'media_cache'),
+            settings.config.media_cache_mb * 1024 * 1024
+        )
+        self.telegram.media_cache = self.media_cache
         self.rules = []
         self.running = False
         self.stats = {}
@@ -30,20 +44,29 @@ class ForwardEngine:
             self.running = True
             logger.info("转发引擎启动")
             
+            # 清理上次退出时遗留的缓存文件
+            if self.media_cache.enabled:
+                await asyncio.get_running_loop().run_in_executor(None, self.media_cache.reconcile)
+                
+            # 补发上次因频率限制积压的推文
+            self.twitter.resume_spilled()
+            
             # 获取所有源群组
             source_groups = set()
             for rule in self.rules:
                 source_groups.add(rule['source_group']['id'])
             
-            # 为每个Telegram账号注册消息处理器
-            for phone, client in self.telegram.clients.items():
-                if not client.is_connected():
-                    await self.telegram.start_client(phone)
-                    
+            # 为每个Telegram账号注册消息处理器，账号并发连接，就绪一个即开始转发一个
+            def listen(phone, client):
                 @client.on(events.NewMessage(chats=list(source_groups)))
                 async def message_handler(event):
                     await self.handle_message(event)
                     
+            results = await self.telegram.start_clients(on_ready=listen)
+            failed = [phone for phone, ok in results.items() if not ok]
+            if failed:
+                logger.warning(f"以下Telegram账号启动失败: {', '.join(failed)}")
+                
         except Exception as e:
             self.running = False
             logger.error(f"启动转发引擎失败: {str(e)}")
@@ -58,6 +81,7 @@ class ForwardEngine:
             self.running = False
             # 停止所有客户端
             await self.telegram.stop_all_clients()
+            await self.twitter.close()
             logger.info("转发引擎已停止")
         except Exception as e:
             logger.error(f"停止转发引擎失败: {str(e)}")
@@ -74,8 +98,8 @@ class ForwardEngine:
                 if r['source_group']['id'] == source_id
             ]
             
-            for rule in matching_rules:
-                await self.process_rule(rule, event)
+            # 各规则并发处理，等待Twitter发送的规则不会拖慢Telegram转发
+            await asyncio.gather(*(self.process_rule(rule, event) for rule in matching_rules))
                 
         except Exception as e:
             logger.error(f"处理消息失败: {str(e)}")
@@ -95,21 +119,25 @@ class ForwardEngine:
             # 根据目标类型转发
             start_time = datetime.now()
             success = False
-            
-            if rule['target_type'] == "Telegram群组":
-                success = await self.forward_to_telegram(rule, event.message)
-            else:  # Twitter
-                success = await self.forward_to_twitter(rule, event.message)
+            error = None
+            
+            try:
+                if rule['target_type'] == "Telegram群组":
+                    success = await self.forward_to_telegram(rule, event.message)
+                else:  # Twitter
+                    success = await self.forward_to_twitter(rule, event.message)
+            except Exception as e:
+                error = e
                 
+            # 先记录日志，统计按今日日志计数，需要包含本条
+            self.log_forward(rule, event.message, success, error)
+            
             # 更新统计
             self.update_stats(rule, success, (datetime.now() - start_time).total_seconds())
             
-            # 记录日志
-            self.log_forward(rule, event.message, success)
-            
         except Exception as e:
             logger.error(f"处理规则失败: {str(e)}")
-            self.log_error(rule['name'], "规则处理", str(e))
+            self.log_error(rule, "规则处理", str(e))
             
     def check_filters(self, rule: dict, message) -> bool:
         """检查消息是否匹配过滤规则"""
@@ -136,32 +164,40 @@ class ForwardEngine:
         """转发到Telegram群组"""
         try:
             target_id = int(rule['target']['id'])
+            # 从实体缓存取得目标，发送前不需要再解析
+            target = await self.telegram.get_input_entity(target_id)
             
             # 检查是否需要转发媒体
             if rule['options']['media_forward'] and message.media:
-                await self.telegram.active_client.send_file(
-                    target_id,
-                    message.media,
+                await self.telegram.send_media(
+                    target,
+                    message,
                     caption=message.text
                 )
             else:
-                await self.telegram.active_client.send_message(
-                    target_id,
+                client = await self.telegram.ensure_connected()
+                await client.send_message(
+                    target,
                     message.text
                 )
                 
             return True
             
+        except (ChannelInvalidError, ChannelPrivateError, PeerIdInvalidError) as e:
+            # 缓存的实体已失效，下次发送时重新解析
+            self.telegram.forget_entity(target_id)
+            logger.error(f"转发到Telegram失败: {str(e)}")
+            raise
         except Exception as e:
             logger.error(f"转发到Telegram失败: {str(e)}")
-            return False
+            raise
             
     async def forward_to_twitter(self, rule: dict, message) -> bool:
         """转发到Twitter"""
         try:
-            # 设置活动Twitter客户端
-            if not self.twitter.set_active_client(rule['target']['id']):
-                raise ValueError(f"Twitter账号 {rule['target']['id']} 未找到")
+            username = rule['target']['id']
+            if username not in self.twitter.clients:
+                raise ValueError(f"Twitter账号 {username} 未找到")
                 
             # 处理文本
             text = message.text or message.caption or ""
@@ -177,73 +213,116 @@ class ForwardEngine:
             if rule['twitter_config']['hashtags']:
                 text = f"{text}\n\n{rule['twitter_config']['hashtags']}"
                 
-            # 处理媒体文件
-            media_paths = []
-            if rule['options']['media_forward'] and message.media:
-                path = await self.telegram.active_client.download_media(message.media)
-                if path:
-                    media_paths.append(path)
-                    
-            # 发送推文
-            success = await self.twitter.send_tweet(text, media_paths)
-            
-            # 清理临时文件
-            for path in media_paths:
-                self.twitter.cleanup_media(path)
+            if not (rule['options']['media_forward'] and message.media):
+                return await self.twitter.send_tweet(text, username=username, rule=rule)
                 
-            return success
-            
+            # 处理媒体文件，下载到发送完成期间占用媒体预算
+            size = message.file.size if message.file else None
+            async with self.media_budget.reserve(size, f"twitter:{username}"):
+                media = []
+                item = await self.download_tweet_media(message)
+                if item:
+                    media.append(item)
+                    
+                try:
+                    # 发送推文
+                    return await self.twitter.send_tweet(text, media, username=username, rule=rule)
+                finally:
+                    # 释放内存中的媒体，清理临时文件
+                    for item in media:
+                        item.cleanup()
+                        
+                        
         except Exception as e:
             logger.error(f"转发到Twitter失败: {str(e)}")
-            return False
+            raise
             
+    async def download_tweet_media(self, message) -> Optional[TweetMedia]:
+        """下载消息中的媒体，小文件直接下载到内存，超过阈值或大小未知时写入临时文件
+        
+        先查找磁盘媒体缓存，命中时直接使用缓存文件；下载的媒体同时写入缓存。
+        使用中的缓存文件在媒体 cleanup 之前不会被淘汰。
+        """
+        file = message.file
+        size = file.size if file else None
+        name = (file.name if file else None) or f"media{(file.ext if file else None) or ''}"
+        loop = asyncio.get_running_loop()
+        key = self.media_cache.key_for(message)
+        if key:
+            cached = await loop.run_in_executor(None, self.media_cache.lookup, key, True)
+            if cached:
+                return self._cached_media(name, cached)
+                
+        if size is not None and size <= self.twitter.MEMORY_MEDIA_LIMIT:
+            data = await self.telegram.download_media_parallel(message)
+            if not data:
+                return None
+            if key:
+                # 直接写入下载缓冲区，在调用方占用的媒体预算内完成
+                await loop.run_in_executor(None, self.media_cache.store_bytes, key, name, data)
+            return TweetMedia(name, data=data)
+            
+        if size is None:
+            client = await self.telegram.ensure_connected()
+            path = await client.download_media(message.media)
+        else:
+            fd, path = tempfile.mkstemp(suffix=os.path.splitext(name)[1])
+            os.close(fd)
+            try:
+                await self.telegram.download_media_parallel(message, path)
+            except BaseException:
+                os.remove(path)
+                raise
+        if not path:
+            return None
+            
+        if key:
+            cached = await loop.run_in_executor(None, self.media_cache.store_file, key, name, path, True)
+            if cached:
+                return self._cached_media(name, cached)
+        return TweetMedia(name, path=path)
+        
+    def _cached_media(self, name: str, path: str) -> TweetMedia:
+        """引用媒体缓存中已固定的文件，cleanup 时释放"""
+        return TweetMedia(name, path=path, temporary=False,
+                          on_cleanup=lambda: self.media_cache.release(path))
+        
     def update_stats(self, rule: dict, success: bool, delay: float):
         """更新统计数据"""
         try:
-            # 获取数据库中的规则
-            db_rule = settings.db.get_rule_by_name(rule['name'])
-            if not db_rule:
-                return
-                
             # 获取今天的统计数据
             today = datetime.now().date()
             
-            # 获取规则的所有日志
-            logs = settings.db.get_forward_logs(
-                rule_id=db_rule.id,
+            # 统计规则今日的日志数量
+            counts = settings.db.count_forward_logs(
+                rule_id=rule['id'],
                 start_date=today.isoformat(),
                 end_date=today.isoformat()
             )
             
-            # 计算统计数据
-            total_messages = len(logs)
-            success_messages = len([log for log in logs if log.status == 'success'])
-            
             # 更新今日统计
             settings.db.update_statistics(
-                rule_id=db_rule.id,
+                rule_id=rule['id'],
                 date=today,
-                total_messages=total_messages,
-                success_messages=success_messages,
+                total_messages=counts['total'],
+                success_messages=counts['success'],
                 avg_delay=delay
             )
             
         except Exception as e:
             logger.error(f"更新统计数据失败: {str(e)}")
             
-    def log_forward(self, rule: dict, message, success: bool):
-        """记录转发日志"""
+    def log_forward(self, rule: dict, message, success: bool,
+                    error: Optional[Exception] = None):
+        """记录转发日志，失败时同时记录异常类型和消息"""
         try:
-            # 获取数据库中的规则
-            db_rule = settings.db.get_rule_by_name(rule['name'])
-            if not db_rule:
-                return
-                
             # 添加日志记录
             settings.db.add_forward_log(
-                rule_id=db_rule.id,
+                rule_id=rule['id'],
                 message_text=message.text[:100] if message.text else '',
-                status='success' if success else 'failed'
+                status='success' if success else 'failed',
+                error_message=str(error) if error else None,
+                error_type=type(error).__name__ if error else None
             )
             
         except Exception as e:
@@ -259,24 +338,15 @@ class ForwardEngine:
         except Exception as e:
             logger.error(f"加载规则失败: {str(e)}")
 
-    def log_error(self, rule_name: Optional[str], error_type: str, error_msg: str):
+    def log_error(self, rule: Optional[dict], error_type: str, error_msg: str):
         """记录错误日志"""
         try:
-            log_entry = {
-                'time': datetime.now().isoformat(),
-                'rule': rule_name,
-                'type': error_type,
-                'message': error_msg
-            }
-            
-            logs = settings.settings.value("logs/errors", [])
-            logs.append(log_entry)
-            
-            # 只保留最近500条错误记录
-            if len(logs) > 500:
-                logs = logs[-500:]
-                
-            settings.settings.setValue("logs/errors", logs)
+            settings.db.add_error_log(
+                error_type=error_type,
+                message=error_msg,
+                rule_id=rule['id'] if rule else None,
+                rule_name=rule['name'] if rule else None
+            )
             
         except Exception as e:
             logger.error(f"记录错误日志失败: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,402 @@
+# core/media.py
+
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+def _compress_image(source, max_bytes: int, max_dimension: int) -> Optional[Tuple[bytes, str]]:
+    """缩放并重新压缩图片，在子进程中执行
+    
+    source 为图片数据或文件路径。图片已满足限制时返回 None，
+    否则返回 (压缩后的数据, 扩展名)。
+    """
+    from PIL import Image, ImageOps
+    
+    image = Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+    original_format = image.format
+    size = len(source) if isinstance(source, (bytes, bytearray)) else os.path.getsize(source)
+    if size <= max_bytes and max(image.size) <= max_dimension and original_format != 'BMP':
+        return None
+        
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_dimension, max_dimension))
+    
+    # 带透明通道的图片先尝试保留为PNG，仍然超限再转为JPEG
+    if image.mode in ('RGBA', 'LA', 'P') and original_format != 'JPEG':
+        output = io.BytesIO()
+        image.save(output, format='PNG', optimize=True)
+        if output.tell() <= max_bytes:
+            return output.getvalue(), '.png'
+            
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    for quality in (90, 85, 75, 65, 50):
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=quality, optimize=True, progressive=True)
+        if output.tell() <= max_bytes:
+            break
+    return output.getvalue(), '.jpg'
+
+class ImagePreprocessor:
+    """在进程池中将图片缩放压缩到Twitter的限制以内
+    
+    结果按原图内容摘要缓存，同一张图片只处理一次。未安装 Pillow 时原样返回。
+    """
+    MAX_BYTES = 5 * 1024 * 1024  # Twitter图片大小上限
+    MAX_DIMENSION = 4096  # 图片最长边的像素上限
+    CACHE_BYTES = 64 * 1024 * 1024  # 处理结果缓存占用的内存上限
+    CACHE_ENTRIES = 1024  # 最多缓存的处理结果数量
+    
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_bytes = 0
+        
+    @staticmethod
+    def available() -> bool:
+        """当前环境是否安装了 Pillow"""
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            return False
+        return True
+        
+    async def prepare(self, media):
+        """返回满足Twitter限制的媒体，非图片或无需处理时返回原对象"""
+        if os.path.splitext(media.name)[1].lower() not in IMAGE_EXTENSIONS or not self.available():
+            return media
+            
+        loop = asyncio.get_running_loop()
+        digest = await loop.run_in_executor(None, media.digest)
+        if digest in self._cache:
+            self._cache.move_to_end(digest)
+            return self._to_media(media, self._cache[digest])
+            
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        source = media.data if media.data is not None else media.path
+        try:
+            result = await loop.run_in_executor(
+                self._executor, _compress_image, source, self.MAX_BYTES, self.MAX_DIMENSION
+            )
+        except Exception as e:
+            logger.warning(f"图片预处理失败，将上传原图: {str(e)}")
+            return media
+            
+        self._remember(digest, result)
+        return self._to_media(media, result)
+        
+    def _remember(self, digest: str, result: Optional[Tuple[bytes, str]]):
+        """缓存处理结果，超出内存上限时淘汰最久未使用的"""
+        self._cache[digest] = result
+        self._cache_bytes += len(result[0]) if result else 0
+        while self._cache and (self._cache_bytes > self.CACHE_BYTES
+                               or len(self._cache) > self.CACHE_ENTRIES):
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_bytes -= len(evicted[0]) if evicted else 0
+            
+    @staticmethod
+    def _to_media(media, result: Optional[Tuple[bytes, str]]):
+        if result is None:
+            return media
+        data, ext = result
+        name = os.path.splitext(media.name)[0] + ext
+        return type(media)(name, data=data)
+        
+    def shutdown(self):
+        """关闭进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+class ByteBudget:
+    """全局的媒体字节预算
+    
+    下载、内存缓冲和上传前按文件大小预留额度，预算用完时在队列中等待而不是失败。
+    等待的请求按目标分组轮流放行，一个目标的大量媒体不会饿死其他目标；
+    轮到的请求放不下时后面的请求也继续等待，大文件不会一直被小文件插队。
+    只能在同一个事件循环中使用。
+    """
+    def __init__(self, capacity: int, default_size: int = 8 * 1024 * 1024):
+        self.capacity = capacity
+        self.default_size = default_size
+        self.used = 0
+        self._waiters: OrderedDict = OrderedDict()
+        
+    @asynccontextmanager
+    async def reserve(self, size: Optional[int], target: str):
+        """预留 size 字节直到退出上下文，大小未知时按 default_size 预留"""
+        # 超过总预算的单个文件独占全部预算，而不是永远等待
+        size = min(size or self.default_size, self.capacity)
+        await self._acquire(size, target)
+        try:
+            yield
+        finally:
+            self._release(size)
+            
+    async def _acquire(self, size: int, target: str):
+        if not self._waiters and self.used + size <= self.capacity:
+            self.used += size
+            return
+            
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(target, deque()).append((size, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已获得额度但任务被取消，归还额度
+                self._release(size)
+            else:
+                future.cancel()
+                self._wake()
+            raise
+            
+    def _release(self, size: int):
+        self.used -= size
+        self._wake()
+        
+    def _wake(self):
+        """按目标轮流放行等待中的请求"""
+        while self._waiters:
+            target, queue = next(iter(self._waiters.items()))
+            size, future = queue[0]
+            if not future.cancelled():
+                if self.used + size > self.capacity:
+                    break
+                self.used += size
+                future.set_result(None)
+            queue.popleft()
+            
+            # 放行后该目标移到队尾，轮到下一个目标
+            del self._waiters[target]
+            if queue:
+                self._waiters[target] = queue
+            
+class MediaCache:
+    """按内容寻址的磁盘媒体缓存
+    
+    文件以内容的 SHA-256 摘要命名，保存在 directory 下，索引记录在数据库中，
+    同一个Telegram媒体在不同规则、重试和重启之间只下载一次。
+    文件先写入临时文件再原子替换，写入完成后才登记索引；
+    启动时清理没有索引的文件和文件已丢失的索引，中途崩溃不会留下无效记录。
+    总大小超过 quota_bytes 时按最近使用时间淘汰。
+    以 pin=True 取得的文件在调用 release 之前不会被淘汰。
+    """
+    def __init__(self, db, directory: str, quota_bytes: int):
+        self.db = db
+        self.directory = directory
+        self.quota_bytes = quota_bytes
+        self._tmp_dir = os.path.join(directory, 'tmp')
+        # 正在使用的内容摘要及其引用计数，淘汰时跳过
+        self._pins: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        
+    @property
+    def enabled(self) -> bool:
+        return self.quota_bytes > 0
+        
+    def key_for(self, message) -> Optional[str]:
+        """消息中媒体的缓存键，使用Telegram的文档或照片ID，无法识别时返回 None"""
+        if not self.enabled:
+            return None
+        document = getattr(message, 'document', None)
+        if document is not None:
+            return f"document:{document.id}"
+        photo = getattr(message, 'photo', None)
+        if photo is not None:
+            return f"photo:{photo.id}"
+        return None
+        
+    def lookup(self, key: str, pin: bool = False) -> Optional[str]:
+        """返回缓存文件路径，未命中时返回 None；pin 为 True 时在 release 之前不会被淘汰"""
+        try:
+            entry = self.db.get_cached_media(key)
+            if entry is None:
+                return None
+            path = self._path(entry['digest'])
+            self._pin(entry['digest'])
+            if os.path.exists(path):
+                if not pin:
+                    self.release(path)
+                return path
+            self.release(path)
+            # 文件已被外部删除，清除失效的索引
+            self.db.delete_cached_media(entry['digest'])
+        except Exception as e:
+            logger.error(f"读取媒体缓存失败: {str(e)}")
+        return None
+        
+    def store_bytes(self, key: str, name: str, data: bytes, pin: bool = False) -> Optional[str]:
+        """将内存中的媒体写入缓存，返回缓存文件路径，失败时返回 None"""
+        digest = None
+        try:
+            digest = hashlib.sha256(data).hexdigest()
+            self._pin(digest)
+            path = self._path(digest)
+            if not os.path.exists(path):
+                tmp_path = self._temp_path()
+                try:
+                    with open(tmp_path, 'wb') as f:
+                        f.write(data)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(tmp_path, path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+            return self._register(key, digest, len(data), name, path, pin)
+        except Exception as e:
+            if digest:
+                self._unpin(digest)
+            logger.error(f"写入媒体缓存失败: {str(e)}")
+            return None
+            
+    def store_file(self, key: str, name: str, source: str, pin: bool = False) -> Optional[str]:
+        """将下载好的文件移入缓存，返回缓存文件路径，失败时返回 None 且保留原文件"""
+        digest = None
+        try:
+            sha = hashlib.sha256()
+            with open(source, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    sha.update(chunk)
+            digest = sha.hexdigest()
+            self._pin(digest)
+            size = os.path.getsize(source)
+            path = self._path(digest)
+            if os.path.exists(path):
+                os.remove(source)
+            else:
+                # 先移到缓存目录内的临时文件，保证最终的替换是原子的
+                tmp_path = self._temp_path()
+                try:
+                    shutil.move(source, tmp_path)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(tmp_path, path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+            return self._register(key, digest, size, name, path, pin)
+        except Exception as e:
+            if digest:
+                self._unpin(digest)
+            logger.error(f"写入媒体缓存失败: {str(e)}")
+            return None
+            
+    def _register(self, key: str, digest: str, size: int, name: str, path: str,
+                  pin: bool) -> Optional[str]:
+        """登记索引，超出配额时淘汰最久未使用的文件；调用时内容已被固定"""
+        self.db.add_cached_media(key, digest, size, name)
+        self.evict()
+        if not pin:
+            self._unpin(digest)
+        return path
+        
+    def release(self, path: str):
+        """释放以 pin=True 取得的缓存文件"""
+        self._unpin(os.path.basename(path))
+        
+    def _pin(self, digest: str):
+        with self._lock:
+            self._pins[digest] = self._pins.get(digest, 0) + 1
+            
+    def _unpin(self, digest: str):
+        with self._lock:
+            count = self._pins.get(digest, 0) - 1
+            if count > 0:
+                self._pins[digest] = count
+            else:
+                self._pins.pop(digest, None)
+                
+    def evict(self):
+        """淘汰最久未使用的缓存，直到总大小不超过配额，正在使用的文件除外"""
+        with self._lock:
+            for digest in self.db.evict_cached_media(self.quota_bytes, keep=set(self._pins)):
+                try:
+                    os.remove(self._path(digest))
+                except OSError:
+                    # 文件正在使用或已不存在，留给下次启动时清理
+                    pass
+                    
+    def reconcile(self):
+        """清理崩溃遗留的临时文件、没有索引的文件和文件已丢失的索引
+        
+        需要在开始读写缓存之前执行。
+        """
+        try:
+            if os.path.isdir(self._tmp_dir):
+                shutil.rmtree(self._tmp_dir, ignore_errors=True)
+                
+            digests = self.db.get_cached_media_digests()
+            removed = 0
+            if os.path.isdir(self.directory):
+                for entry in os.scandir(self.directory):
+                    if not entry.is_dir() or entry.path == self._tmp_dir:
+                        continue
+                    for file in os.scandir(entry.path):
+                        if file.name not in digests:
+                            os.remove(file.path)
+                            removed += 1
+                            
+            for digest in digests:
+                if not os.path.exists(self._path(digest)):
+                    self.db.delete_cached_media(digest)
+                    removed += 1
+                    
+            self.evict()
+            if removed:
+                logger.info(f"媒体缓存已清理 {removed} 个失效条目")
+        except Exception as e:
+            logger.error(f"清理媒体缓存失败: {str(e)}")
+            
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+        
+    def _temp_path(self) -> str:
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        return os.path.join(self._tmp_dir, f"{uuid.uuid4().hex}.part")
+            
+class BufferReader(io.RawIOBase):
+    """以只读文件对象的方式读取内存缓冲区，不复制整个缓冲区"""
+    def __init__(self, buffer):
+        self._view = memoryview(buffer)
+        self._pos = 0
+        
+    def readable(self) -> bool:
+        return True
+        
+    def seekable(self) -> bool:
+        return True
+        
+    def readinto(self, b) -> int:
+        n = max(min(len(b), len(self._view) - self._pos), 0)
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+        
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(base + offset, 0)
+        return self._pos
+        
+    def tell(self) -> int:
+        return self._pos
+        
+    def close(self):
+        self._view.release()
+        super().close()
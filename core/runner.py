@@ -0,0 +1,40 @@
+# core/runner.py
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Optional
+
+class AsyncRunner:
+    """在专用线程中长期运行的事件循环
+    
+    Telethon 客户端绑定第一次连接时的事件循环，之后不能在其他事件循环中使用。
+    界面中的Telegram操作和转发引擎都提交到这个事件循环执行，不再为每个操作新建事件循环。
+    不能在该事件循环自己的线程中调用 run，否则会死锁。
+    """
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """事件循环，第一次使用时启动后台线程"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever,
+                    name='asyncio-runner',
+                    daemon=True
+                ).start()
+            return self._loop
+            
+    def submit(self, coro: Coroutine) -> Future:
+        """提交协程，立即返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+        
+    def run(self, coro: Coroutine, timeout: float = None) -> Any:
+        """提交协程并阻塞等待结果"""
+        return self.submit(coro).result(timeout)
+
+runner = AsyncRunner()
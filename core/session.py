@@ -0,0 +1,172 @@
+# core/session.py
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+from telethon.crypto import AuthKey
+from telethon.sessions import MemorySession, SQLiteSession
+from telethon.tl.types.updates import State
+
+logger = logging.getLogger(__name__)
+
+class SnapshotSession(MemorySession):
+    """会话状态保存在内存中，定期整体写入快照文件
+    
+    Telethon 收到更新和实体时只修改内存，不再对每个账号的 SQLite 会话文件频繁提交。
+    登录信息变化时立即保存，其余变化每隔 save_interval 秒随 Telethon 的定期保存写入一次，
+    断开连接和程序退出时再写入一次。快照先写入临时文件再原子替换，
+    写入过程中崩溃时保留上一次完整的快照。
+    首次使用时从同名的 SQLite 会话文件迁移登录状态，已登录的账号不需要重新登录。
+    """
+    SUFFIX = '.snapshot'
+    
+    _instances = weakref.WeakSet()
+    
+    def __init__(self, name: str, save_interval: float = 60):
+        super().__init__()
+        self.path = name + self.SUFFIX
+        self.save_interval = save_interval
+        self._dirty = False
+        self._auth_dirty = False
+        self._last_write = time.monotonic()
+        self._write_lock = threading.Lock()
+        
+        if os.path.exists(self.path):
+            self._load()
+        elif os.path.exists(name + '.session'):
+            self._migrate(name)
+            
+        self._instances.add(self)
+        
+    # 登录信息变化需要立即保存
+    def set_dc(self, dc_id, server_address, port):
+        super().set_dc(dc_id, server_address, port)
+        self._dirty = self._auth_dirty = True
+        
+    @property
+    def auth_key(self):
+        return self._auth_key
+        
+    @auth_key.setter
+    def auth_key(self, value):
+        self._auth_key = value
+        self._dirty = self._auth_dirty = True
+        
+    @property
+    def takeout_id(self):
+        return self._takeout_id
+        
+    @takeout_id.setter
+    def takeout_id(self, value):
+        self._takeout_id = value
+        self._dirty = True
+        
+    def set_update_state(self, entity_id, state):
+        super().set_update_state(entity_id, state)
+        self._dirty = True
+        
+    def process_entities(self, tlo):
+        count = len(self._entities)
+        super().process_entities(tlo)
+        if len(self._entities) != count:
+            self._dirty = True
+            
+    def save(self):
+        """Telethon 在登录、切换DC和每分钟的保活时调用，只在需要时写入快照"""
+        if self._auth_dirty or (
+                self._dirty and time.monotonic() - self._last_write >= self.save_interval):
+            self.flush()
+            
+    def close(self):
+        self.flush()
+        
+    def delete(self):
+        self._instances.discard(self)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+            
+    def flush(self):
+        """有未保存的变化时写入快照"""
+        if not self._dirty:
+            return
+            
+        with self._write_lock:
+            data = self._snapshot()
+            self._dirty = self._auth_dirty = False
+            tmp_path = f"{self.path}.part"
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                self._last_write = time.monotonic()
+            except Exception as e:
+                self._dirty = True
+                logger.error(f"保存会话快照失败: {str(e)}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                    
+    def _snapshot(self) -> dict:
+        return {
+            'dc_id': self._dc_id,
+            'server_address': self._server_address,
+            'port': self._port,
+            'auth_key': self._auth_key.key.hex() if self._auth_key and self._auth_key.key else None,
+            'takeout_id': self._takeout_id,
+            'entities': [list(row) for row in self._entities],
+            'update_states': [
+                [entity_id, state.pts, state.qts, state.date.timestamp(), state.seq]
+                for entity_id, state in self._update_states.items()
+            ],
+        }
+        
+    def _load(self):
+        """从快照文件恢复会话状态"""
+        with open(self.path, encoding='utf-8') as f:
+            data = json.load(f)
+        self._dc_id = data['dc_id']
+        self._server_address = data['server_address']
+        self._port = data['port']
+        self._auth_key = AuthKey(bytes.fromhex(data['auth_key'])) if data['auth_key'] else None
+        self._takeout_id = data['takeout_id']
+        self._entities = {tuple(row) for row in data['entities']}
+        self._update_states = {
+            entity_id: State(pts, qts, datetime.fromtimestamp(date, tz=timezone.utc), seq, unread_count=0)
+            for entity_id, pts, qts, date, seq in data['update_states']
+        }
+        
+    def _migrate(self, name: str):
+        """从 SQLite 会话文件迁移登录信息、实体和更新状态，并立即写入快照"""
+        old = SQLiteSession(name)
+        try:
+            super().set_dc(old.dc_id, old.server_address, old.port)
+            self._auth_key = old.auth_key
+            self._takeout_id = old.takeout_id
+            cursor = old._cursor()
+            try:
+                self._entities = {
+                    tuple(row) for row in
+                    cursor.execute('SELECT id, hash, username, phone, name FROM entities')
+                }
+            finally:
+                cursor.close()
+            self._update_states = dict(old.get_update_states())
+        finally:
+            old.close()
+            
+        self._dirty = True
+        self.flush()
+        logger.info(f"已将会话 {name} 迁移为内存会话")
+
+@atexit.register
+def _flush_all():
+    """程序退出时写入所有未保存的会话快照"""
+    for session in list(SnapshotSession._instances):
+        session.flush()
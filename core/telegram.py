@@ -1,43 +1,93 @@
 # core/telegram.py
 
-from telethon import TelegramClient, events
-from telethon.tl.types import InputPeerChannel, InputPeerUser
+from telethon import TelegramClient, events, utils
+from telethon.tl.types import InputPeerChannel, InputPeerChat, InputPeerUser, PeerChannel, PeerChat
 from telethon.tl.functions.messages import GetDialogsRequest
 from telethon.tl.functions.channels import JoinChannelRequest
-from telethon.errors import SessionPasswordNeededError
+from telethon.errors import RPCError, SessionPasswordNeededError
 import asyncio
 import logging
-from typing import List, Dict, Optional
+import os
+import tempfile
+import time
+from typing import List, Dict, Optional, Union
 from datetime import datetime
 from config.settings import settings
+from .media import BufferReader, ByteBudget, MediaCache
+from .session import SnapshotSession
 
 logger = logging.getLogger(__name__)
 
 class TelegramManager:
+    DOWNLOAD_PART_SIZE = 512 * 1024  # 每次请求的分片大小，Telegram允许的最大值
+    DOWNLOAD_PARALLELISM = 4  # 单个文件并发下载的分片数
+    DOWNLOAD_MAX_INFLIGHT = 4 * 1024 * 1024  # 单个文件同时在传输中的字节上限
+    PARALLEL_DOWNLOAD_MIN_SIZE = 4 * 1024 * 1024  # 小于该大小的文件直接顺序下载
+    MEDIA_HANDLE_TTL = 600  # 已发送媒体句柄的复用时间（秒）
+    MEMORY_MEDIA_LIMIT = 16 * 1024 * 1024  # 重新上传时不超过该大小的媒体直接下载到内存
+    IDLE_CHECK_INTERVAL = 60  # 检查空闲连接的最短间隔（秒）
+    STARTUP_CONCURRENCY = 8  # 批量启动时同时建立连接的账号数
+    STARTUP_TIMEOUT = 60  # 批量启动时单个账号的超时时间（秒）
+    
     def __init__(self):
+        # 保存的账号配置，客户端在第一次使用时才创建
+        self.accounts: Dict[str, Dict] = {}
         self.clients: Dict[str, TelegramClient] = {}
         self.active_client: Optional[TelegramClient] = None
+        self.active_phone: Optional[str] = None
+        # 连接管理：已确认登录的账号、最近使用时间、需要保持连接的账号
+        self.idle_timeout = settings.config.telegram_idle_timeout
+        self._authorized: set = set()
+        self._last_used: Dict[str, float] = {}
+        self._keep_alive: set = set()
+        self._connect_locks: Dict[str, asyncio.Lock] = {}
+        # 客户端连接时所在的事件循环，Telethon 客户端不能跨事件循环使用
+        self._client_loops: Dict[str, asyncio.AbstractEventLoop] = {}
+        self._last_idle_check = 0.0
+        # 已解析的实体：(账号, 对话ID) -> InputPeer，持久化在数据库的实体缓存中
+        self._entities: Dict[tuple, object] = {}
+        # 已发送媒体的句柄缓存：(客户端, 源聊天, 消息ID) -> (媒体, 过期时间)
+        self._media_handles: Dict[tuple, tuple] = {}
+        self._media_locks: Dict[tuple, asyncio.Lock] = {}
+        # 媒体字节预算，由转发引擎设置
+        self.media_budget: Optional[ByteBudget] = None
+        # 磁盘媒体缓存，由转发引擎设置
+        self.media_cache: Optional[MediaCache] = None
         self._load_accounts()
         
     def _load_accounts(self):
-        """加载所有保存的账号"""
+        """加载所有保存的账号，只记录配置，不打开会话文件"""
         accounts = settings.get_telegram_accounts()
         for account in accounts:
-            self.add_client(
-                phone=account['phone'],
-                api_id=account['api_id'],
-                api_hash=account['api_hash']
-            )
+            self.accounts[account['phone']] = {
+                'api_id': account['api_id'],
+                'api_hash': account['api_hash']
+            }
             
+    def get_client(self, phone: str) -> Optional[TelegramClient]:
+        """获取账号的客户端，尚未创建时按保存的配置创建"""
+        client = self.clients.get(phone)
+        if client is None and phone in self.accounts:
+            client = self.add_client(phone, **self.accounts[phone])
+        return client
+        
     def add_client(self, phone: str, api_id: str, api_hash: str) -> TelegramClient:
         """添加新的客户端"""
         try:
+            self.accounts[phone] = {'api_id': api_id, 'api_hash': api_hash}
+            
             # 创建会话名称
             session_name = f"sessions/{phone}"
-            
+            session = session_name
+            if settings.config.telegram_memory_sessions:
+                session = SnapshotSession(
+                    session_name,
+                    save_interval=settings.config.telegram_session_save_interval
+                )
+                
             # 创建客户端
             client = TelegramClient(
-                session_name,
+                session,
                 api_id,
                 api_hash,
                 device_model="Desktop",
@@ -53,35 +103,40 @@ class TelegramManager:
             raise
             
     async def start_client(self, phone: str, code_callback=None) -> bool:
-        """启动指定的客户端"""
+        """启动指定的客户端并设为当前账号
+        
+        已确认登录的账号直接切换，现有连接继续复用，未连接时在第一次使用时再连接。
+        """
         try:
-            client = self.clients.get(phone)
+            client = self._client_for_loop(phone)
             if not client:
                 raise ValueError(f"未找到手机号为 {phone} 的客户端")
                 
-            # 如果已经连接，先断开
-            if client.is_connected():
-                await client.disconnect()
+            if phone not in self._authorized:
+                await self._connect(phone, client)
                 
-            # 启动客户端
-            await client.connect()
-            
-            # 如果需要登录
-            if not await client.is_user_authorized():
-                # 发送验证码
-                await client.send_code_request(phone)
-                
-                # 如果提供了回调函数，使用它获取验证码
-                if code_callback:
-                    code = await code_callback()
-                    try:
-                        await client.sign_in(phone, code)
-                    except SessionPasswordNeededError:
-                        # 如果启用了两步验证，需要输入密码
-                        password = await code_callback(password=True)
-                        await client.sign_in(password=password)
-                        
+                # 如果需要登录
+                if not await client.is_user_authorized():
+                    # 发送验证码
+                    await client.send_code_request(phone)
+                    
+                    # 如果提供了回调函数，使用它获取验证码
+                    if code_callback:
+                        code = await code_callback()
+                        try:
+                            await client.sign_in(phone, code)
+                        except SessionPasswordNeededError:
+                            # 如果启用了两步验证，需要输入密码
+                            password = await code_callback(password=True)
+                            await client.sign_in(password=password)
+                        self._authorized.add(phone)
+                else:
+                    self._authorized.add(phone)
+                    
             self.active_client = client
+            self.active_phone = phone
+            self._last_used[phone] = time.monotonic()
+            await self._disconnect_idle()
             logger.info(f"Telegram客户端 {phone} 启动成功")
             return True
             
@@ -89,38 +144,419 @@ class TelegramManager:
             logger.error(f"启动Telegram客户端失败: {str(e)}")
             return False
             
-    async def get_dialogs(self) -> List[Dict]:
-        """获取所有对话（群组/频道）"""
+    async def ensure_connected(self, phone: str = None, keep_alive: bool = False) -> TelegramClient:
+        """返回已连接的客户端，默认为当前账号
+        
+        连接正常时直接复用，断开时才重新连接。keep_alive 为 True 的账号
+        （例如正在接收消息的账号）不会因为空闲而被断开。
+        """
+        phone = phone or self.active_phone
+        client = self._client_for_loop(phone) if phone else self.active_client
+        if not client:
+            raise ValueError("没有活动的客户端")
+            
+        if phone:
+            self._last_used[phone] = time.monotonic()
+            if keep_alive:
+                self._keep_alive.add(phone)
+        if not client.is_connected():
+            await self._connect(phone, client)
+        await self._disconnect_idle()
+        return client
+        
+    async def start_clients(self, phones: List[str] = None, on_ready=None,
+                            concurrency: int = None, timeout: float = None) -> Dict[str, bool]:
+        """并发连接多个已登录的账号（默认为全部账号），返回每个账号是否启动成功
+        
+        同时建立连接的账号数不超过 concurrency，单个账号超过 timeout 秒未就绪即放弃，
+        不影响其他账号。每个账号就绪后立即调用 on_ready(phone, client)，不等待其他账号。
+        启动的账号保持连接，不会因空闲被断开。
+        """
+        phones = list(self.accounts) if phones is None else phones
+        semaphore = asyncio.Semaphore(concurrency or self.STARTUP_CONCURRENCY)
+        timeout = timeout or self.STARTUP_TIMEOUT
+        
+        async def start(phone: str) -> bool:
+            async with semaphore:
+                try:
+                    client = await asyncio.wait_for(self._start_account(phone), timeout)
+                except asyncio.TimeoutError:
+                    logger.error(f"Telegram客户端 {phone} 启动超时")
+                    await self.stop_client(phone)
+                    return False
+                except Exception as e:
+                    logger.error(f"启动Telegram客户端 {phone} 失败: {str(e)}")
+                    return False
+                    
+            if on_ready:
+                try:
+                    on_ready(phone, client)
+                except Exception as e:
+                    logger.error(f"Telegram客户端 {phone} 就绪回调失败: {str(e)}")
+                    return False
+            logger.info(f"Telegram客户端 {phone} 启动成功")
+            return True
+            
+        results = await asyncio.gather(*(start(phone) for phone in phones))
+        return dict(zip(phones, results))
+        
+    async def _start_account(self, phone: str) -> TelegramClient:
+        """连接账号并确认已登录，没有当前账号时设为当前账号
+        
+        确认已登录后才保持连接，未登录的账号断开连接，不占用连接。
+        """
+        client = await self.ensure_connected(phone)
+        if phone not in self._authorized:
+            if not await client.is_user_authorized():
+                await self.stop_client(phone)
+                raise ValueError(f"账号 {phone} 未登录")
+            self._authorized.add(phone)
+        self._keep_alive.add(phone)
+        if self.active_client is None:
+            self.active_client = client
+            self.active_phone = phone
+        return client
+        
+    def _client_for_loop(self, phone: str) -> Optional[TelegramClient]:
+        """返回可在当前事件循环中使用的客户端
+        
+        Telethon 客户端绑定第一次连接时的事件循环。原事件循环已停止时连接已不可用，
+        重新创建客户端；原事件循环仍在其他线程中运行时无法安全迁移，直接报错。
+        """
+        client = self.get_client(phone)
+        bound = self._client_loops.get(phone)
+        loop = asyncio.get_running_loop()
+        if client is None or bound is None or bound is loop:
+            return client
+        if bound.is_running():
+            raise RuntimeError(f"Telegram客户端 {phone} 已在另一个事件循环中连接，不能在当前事件循环中使用")
+            
+        logger.info(f"Telegram客户端 {phone} 的事件循环已停止，重新创建客户端")
+        try:
+            client.session.close()
+        except Exception as e:
+            logger.warning(f"关闭会话失败: {str(e)}")
+        del self.clients[phone]
+        del self._client_loops[phone]
+        self._connect_locks.pop(phone, None)
+        new_client = self.get_client(phone)
+        if self.active_client is client:
+            self.active_client = new_client
+        return new_client
+        
+    async def _connect(self, phone: Optional[str], client: TelegramClient):
+        """建立连接，同一账号的并发调用只连接一次"""
+        lock = self._connect_locks.setdefault(phone, asyncio.Lock())
+        async with lock:
+            if not client.is_connected():
+                await client.connect()
+                if phone:
+                    self._client_loops[phone] = asyncio.get_running_loop()
+                
+    async def _disconnect_idle(self):
+        """断开空闲超过 idle_timeout 秒的连接，当前账号和需要保持连接的账号除外"""
+        now = time.monotonic()
+        if not self.idle_timeout or now - self._last_idle_check < self.IDLE_CHECK_INTERVAL:
+            return
+        self._last_idle_check = now
+        
+        for phone, last_used in list(self._last_used.items()):
+            if (phone == self.active_phone or phone in self._keep_alive
+                    or now - last_used < self.idle_timeout):
+                continue
+            del self._last_used[phone]
+            client = self.clients.get(phone)
+            if client and client.is_connected():
+                try:
+                    await client.disconnect()
+                    logger.info(f"Telegram客户端 {phone} 空闲，已断开连接")
+                except Exception as e:
+                    logger.warning(f"断开空闲客户端失败: {str(e)}")
+                    
+    async def get_dialogs(self, full: bool = False) -> List[Dict]:
+        """同步并获取所有对话（群组/频道）
+        
+        对话按最近消息时间排列，增量同步只拉取上次同步之后有新消息的对话，
+        遇到没有变化的对话即停止。full 为 True 时拉取全部对话，并删除已退出的群组。
+        同步结果保存在实体缓存中，返回缓存中的对话列表。
+        """
         if not self.active_client:
             raise ValueError("没有活动的客户端")
             
         try:
-            dialog_list = []
-            async for dialog in self.active_client.iter_dialogs():
+            phone = self.active_phone
+            watermark = None if full else settings.db.get_dialog_sync_watermark(phone)
+            started = int(time.time() * 1000)
+            entities = []
+            client = await self.ensure_connected()
+            async for dialog in client.iter_dialogs():
+                last_ts = int(dialog.date.timestamp() * 1000) if dialog.date else None
+                # 置顶对话不按时间排列，不能据此判断后面的对话没有变化
+                if (watermark is not None and not dialog.pinned
+                        and last_ts is not None and last_ts < watermark):
+                    break
                 if dialog.is_channel or dialog.is_group:
-                    dialog_list.append({
-                        'id': dialog.id,
-                        'title': dialog.title,
+                    entities.append({
+                        'peer_id': dialog.id,
+                        'access_hash': getattr(dialog.entity, 'access_hash', None),
                         'type': 'channel' if dialog.is_channel else 'group',
-                        'members_count': dialog.entity.participants_count if hasattr(dialog.entity, 'participants_count') else None
+                        'title': dialog.title,
+                        'members_count': getattr(dialog.entity, 'participants_count', None),
+                        'last_message_ts': last_ts
                     })
-            return dialog_list
+                    
+            if entities:
+                settings.db.save_telegram_entities(phone, entities)
+            if full:
+                settings.db.delete_stale_telegram_dialogs(phone, started)
+                self._entities = {k: v for k, v in self._entities.items() if k[0] != phone}
+            return self.get_cached_dialogs(phone)
         except Exception as e:
             logger.error(f"获取对话列表失败: {str(e)}")
             raise
             
+    def get_cached_dialogs(self, phone: str = None) -> List[Dict]:
+        """从实体缓存读取账号的群组和频道，不访问网络"""
+        return [{
+            'id': row['peer_id'],
+            'title': row['title'],
+            'type': row['type'],
+            'members_count': row['members_count']
+        } for row in settings.db.get_telegram_dialogs(phone or self.active_phone)]
+        
+    async def get_input_entity(self, chat_id: int):
+        """获取对话的 InputPeer
+        
+        依次查找内存和数据库中的实体缓存，都没有时才向服务器解析并写入缓存，
+        发送消息时不再需要解析实体的往返请求。
+        """
+        if not self.active_client:
+            raise ValueError("没有活动的客户端")
+            
+        key = (self.active_phone, chat_id)
+        peer = self._entities.get(key)
+        if peer is not None:
+            return peer
+            
+        row = settings.db.get_telegram_entity(self.active_phone, chat_id)
+        if row and (row['access_hash'] is not None or row['type'] == 'group'):
+            peer = self._to_input_peer(row['peer_id'], row['access_hash'])
+        else:
+            client = await self.ensure_connected()
+            peer = await client.get_input_entity(chat_id)
+            settings.db.save_telegram_entities(self.active_phone, [{
+                'peer_id': chat_id,
+                'access_hash': getattr(peer, 'access_hash', None),
+                'type': {
+                    InputPeerChannel: 'channel',
+                    InputPeerChat: 'group',
+                }.get(type(peer), 'user')
+            }])
+            
+        self._entities[key] = peer
+        return peer
+        
+    def forget_entity(self, chat_id: int):
+        """删除失效的实体缓存，下次使用时重新解析"""
+        self._entities.pop((self.active_phone, chat_id), None)
+        settings.db.invalidate_telegram_entity(self.active_phone, chat_id)
+        
+    @staticmethod
+    def _to_input_peer(peer_id: int, access_hash: Optional[int]):
+        """由带类型标记的对话ID和 access_hash 构造 InputPeer"""
+        real_id, peer_type = utils.resolve_id(peer_id)
+        if peer_type is PeerChannel:
+            return InputPeerChannel(real_id, access_hash)
+        if peer_type is PeerChat:
+            return InputPeerChat(real_id)
+        return InputPeerUser(real_id, access_hash)
+            
     async def join_channel(self, channel_link: str) -> bool:
         """加入频道"""
         if not self.active_client:
             raise ValueError("没有活动的客户端")
             
         try:
-            await self.active_client(JoinChannelRequest(channel_link))
+            client = await self.ensure_connected()
+            await client(JoinChannelRequest(channel_link))
             return True
         except Exception as e:
             logger.error(f"加入频道失败: {str(e)}")
             return False
             
+    async def download_media_parallel(self, message, path: str = None,
+                                      parallelism: int = None) -> Union[bytearray, str, None]:
+        """并发分片下载消息中的文件
+        
+        大文件按分片交错分给多个任务，由 iter_download 从文件所在的DC并发拉取，
+        写入预分配的内存缓冲区，指定 path 时写入预分配大小的稀疏文件。
+        同时传输中的数据不超过 DOWNLOAD_MAX_INFLIGHT 字节。
+        小文件、图片和大小未知的文件仍按顺序下载。
+        返回内存缓冲区，或指定 path 时返回文件路径。
+        """
+        client = getattr(message, 'client', None) or self.active_client
+        if not client:
+            raise ValueError("没有活动的客户端")
+            
+        document = message.document
+        size = message.file.size if message.file else None
+        if not document or not size or size < self.PARALLEL_DOWNLOAD_MIN_SIZE:
+            return await client.download_media(message.media, file=path or bytes)
+            
+        part = self.DOWNLOAD_PART_SIZE
+        workers = min(parallelism or self.DOWNLOAD_PARALLELISM,
+                      self.DOWNLOAD_MAX_INFLIGHT // part,
+                      -(-size // part))
+        workers = max(workers, 1)
+        stride = part * workers
+        total_parts = -(-size // part)
+        
+        if path is None:
+            buffer = bytearray(size)
+            
+            def write(offset: int, data: bytes):
+                buffer[offset:offset + len(data)] = data
+        else:
+            output = open(path, 'wb')
+            output.truncate(size)
+            
+            def write(offset: int, data: bytes):
+                # 写入都在事件循环线程中完成，定位和写入之间不会被其他任务打断
+                output.seek(offset)
+                output.write(data)
+                
+        async def fetch(index: int):
+            offset = index * part
+            # 每个任务只请求属于自己的分片，不会请求超出文件末尾的偏移
+            async for chunk in client.iter_download(
+                document,
+                offset=offset,
+                stride=stride,
+                limit=-(-(total_parts - index) // workers),
+                request_size=part,
+                chunk_size=part,
+                file_size=size
+            ):
+                write(offset, chunk)
+                offset += stride
+                
+        try:
+            await asyncio.gather(*(fetch(i) for i in range(workers)))
+        finally:
+            if path is not None:
+                output.close()
+                
+        return buffer if path is None else path
+        
+    async def send_media(self, chat_id: int, message, caption: str = None):
+        """发送消息中的媒体到目标群组
+        
+        同一条消息发往多个目标时只上传一次：先直接引用原媒体发送，
+        无法引用时（受保护的聊天、其他账号收到的消息等）下载后上传一次。
+        之后的目标和重试都复用第一次发送得到的媒体句柄，句柄缓存 MEDIA_HANDLE_TTL 秒。
+        """
+        if not self.active_client:
+            raise ValueError("没有活动的客户端")
+            
+        client = await self.ensure_connected()
+        key = (id(client), message.chat_id, message.id)
+        handle = self._get_media_handle(key)
+        if handle is None:
+            # 并发发往多个目标时，其余目标等待第一次发送完成后复用句柄
+            lock = self._media_locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                handle = self._get_media_handle(key)
+                if handle is None:
+                    try:
+                        sent = await self._send_media_once(client, chat_id, message, caption)
+                        self._media_handles[key] = (sent.media, time.time() + self.MEDIA_HANDLE_TTL)
+                        return sent
+                    finally:
+                        self._media_locks.pop(key, None)
+                        
+        try:
+            return await client.send_file(chat_id, handle, caption=caption)
+        except RPCError as e:
+            # 文件引用过期等原因导致句柄失效，丢弃句柄后重新发送一次
+            logger.warning(f"媒体句柄已失效，重新发送: {str(e)}")
+            self._media_handles.pop(key, None)
+            sent = await self._send_media_once(client, chat_id, message, caption)
+            self._media_handles[key] = (sent.media, time.time() + self.MEDIA_HANDLE_TTL)
+            return sent
+        
+    async def _send_media_once(self, client: TelegramClient, chat_id: int, message, caption: str):
+        """第一次发送媒体，引用原媒体失败时下载并重新上传"""
+        if getattr(message, 'client', None) is client:
+            try:
+                return await client.send_file(chat_id, message.media, caption=caption)
+            except RPCError as e:
+                logger.warning(f"无法直接引用原媒体，改为重新上传: {str(e)}")
+                
+        name = message.file.name or f"media{message.file.ext or ''}"
+        attributes = message.document.attributes if message.document else None
+        loop = asyncio.get_running_loop()
+        key = self.media_cache.key_for(message) if self.media_cache else None
+        if key:
+            cached = await loop.run_in_executor(None, self.media_cache.lookup, key, True)
+            if cached:
+                # 从缓存文件流式上传，不需要下载
+                try:
+                    input_file = await client.upload_file(cached, file_name=name)
+                finally:
+                    self.media_cache.release(cached)
+                return await client.send_file(chat_id, input_file, caption=caption, attributes=attributes)
+                
+        # 下载和上传期间占用媒体预算，小文件下载到内存，大文件或大小未知时写入临时文件
+        size = message.file.size
+        budget = self.media_budget or ByteBudget(float('inf'))
+        async with budget.reserve(size, f"telegram:{chat_id}"):
+            if size is not None and size <= self.MEMORY_MEDIA_LIMIT:
+                data = await self.download_media_parallel(message)
+                # 写缓存和上传同时进行，都在占用预算期间完成
+                store = loop.run_in_executor(
+                    None, self.media_cache.store_bytes, key, name, data
+                ) if key else None
+                try:
+                    input_file = await client.upload_file(
+                        BufferReader(data), file_size=len(data), file_name=name
+                    )
+                finally:
+                    if store:
+                        await store
+            else:
+                input_file = await self._upload_via_file(client, message, name, key)
+                
+        return await client.send_file(chat_id, input_file, caption=caption, attributes=attributes)
+        
+    async def _upload_via_file(self, client: TelegramClient, message, name: str, key: Optional[str]):
+        """下载到临时文件后上传，有缓存键时先将文件移入媒体缓存"""
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(name)[1])
+        os.close(fd)
+        try:
+            await self.download_media_parallel(message, path)
+            cached = None
+            if key:
+                cached = await asyncio.get_running_loop().run_in_executor(
+                    None, self.media_cache.store_file, key, name, path, True
+                )
+            try:
+                return await client.upload_file(cached or path, file_name=name)
+            finally:
+                if cached:
+                    self.media_cache.release(cached)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+            
+                
+    def _get_media_handle(self, key: tuple):
+        """获取未过期的媒体句柄，同时清理过期的缓存"""
+        now = time.time()
+        for expired in [k for k, (_, expiry) in self._media_handles.items() if expiry <= now]:
+            del self._media_handles[expired]
+        cached = self._media_handles.get(key)
+        return cached[0] if cached else None
+        
     async def forward_message(self, message, target_chat_id: int) -> bool:
         """转发消息到目标群组"""
         if not self.active_client:
@@ -128,7 +564,8 @@ class TelegramManager:
             
         try:
             # 转发消息
-            await self.active_client.forward_messages(
+            client = await self.ensure_connected()
+            await client.forward_messages(
                 target_chat_id,
                 message
             )
@@ -143,14 +580,15 @@ class TelegramManager:
             raise ValueError("没有活动的客户端")
             
         try:
+            client = await self.ensure_connected()
             if file:
-                await self.active_client.send_file(
+                await client.send_file(
                     chat_id,
                     file,
                     caption=text
                 )
             else:
-                await self.active_client.send_message(
+                await client.send_message(
                     chat_id,
                     text
                 )
@@ -175,14 +613,16 @@ class TelegramManager:
         """停止指定的客户端"""
         try:
             client = self.clients.get(phone)
+            self._last_used.pop(phone, None)
+            self._keep_alive.discard(phone)
             if client and client.is_connected():
                 await client.disconnect()
                 if client == self.active_client:
                     self.active_client = None
+                    self.active_phone = None
         except Exception as e:
             logger.error(f"停止客户端失败: {str(e)}")
             
     async def stop_all_clients(self):
         """停止所有客户端"""
-        for phone in self.clients:
-            await self.stop_client(phone)
\ No newline at end of file
+        await asyncio.gather(*(self.stop_client(phone) for phone in list(self.clients)))
\ No newline at end of file
@@ -3,18 +3,118 @@
 import tweepy
 import logging
 import asyncio
-from typing import List, Dict, Optional
+import hashlib
+import io
+from typing import Callable, List, Dict, Optional
 from datetime import datetime
 import tempfile
 import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
 from config.settings import settings
+from .media import ImagePreprocessor
 
 logger = logging.getLogger(__name__)
 
+# tweepy 4.x 的频率限制异常为 TooManyRequests，3.x 为 RateLimitError
+RateLimitError = getattr(tweepy, 'TooManyRequests', None) or getattr(tweepy, 'RateLimitError')
+
+class TweetMedia:
+    """待上传到Twitter的媒体，数据在内存中或在磁盘文件中
+    
+    on_cleanup 在 cleanup 时调用，用于释放对共享文件（如媒体缓存中的文件）的占用。
+    """
+    __slots__ = ('name', 'data', 'path', 'temporary', 'on_cleanup', '_digest')
+    
+    def __init__(self, name: str, data: bytes = None, path: str = None,
+                 temporary: bool = True, on_cleanup: Callable[[], None] = None):
+        self.name = name
+        self.data = data
+        self.path = path
+        self.temporary = temporary
+        self.on_cleanup = on_cleanup
+        self._digest = None
+        
+    @classmethod
+    def from_path(cls, path: str, temporary: bool = True) -> 'TweetMedia':
+        return cls(os.path.basename(path), path=path, temporary=temporary)
+        
+    @property
+    def size(self) -> int:
+        return len(self.data) if self.data is not None else os.path.getsize(self.path)
+        
+    def digest(self) -> str:
+        """媒体内容的 SHA-256 摘要"""
+        if self._digest is None:
+            sha = hashlib.sha256()
+            with self.open() as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    sha.update(chunk)
+            self._digest = sha.hexdigest()
+        return self._digest
+        
+    def open(self):
+        """以二进制文件对象打开媒体数据"""
+        return io.BytesIO(self.data) if self.data is not None else open(self.path, 'rb')
+        
+    def save(self, path: str):
+        """将媒体保存到指定路径"""
+        if self.data is not None:
+            with open(path, 'wb') as f:
+                f.write(self.data)
+        else:
+            shutil.copyfile(self.path, path)
+            
+    def cleanup(self):
+        """释放内存数据，删除临时文件"""
+        self.data = None
+        if self.path and self.temporary and os.path.exists(self.path):
+            os.remove(self.path)
+        if self.on_cleanup is not None:
+            on_cleanup, self.on_cleanup = self.on_cleanup, None
+            on_cleanup()
+            
 class TwitterManager:
+    MAX_WORKERS = 4  # 同时调用Twitter接口的线程数
+    RATE_LIMIT_WINDOW = 900  # 响应中没有重置时间时的默认窗口长度（秒）
+    RATE_LIMIT_MIN_BACKOFF = 60  # 触发频率限制后至少等待的时间（秒）
+    MEMORY_MEDIA_LIMIT = 16 * 1024 * 1024  # 不超过该大小的媒体直接下载到内存
+    SIMPLE_UPLOAD_LIMIT = 5 * 1024 * 1024  # 超过该大小的媒体使用分块上传
+    VERIFY_TTL = 3600  # 凭据验证成功结果的缓存时间（秒）
+    VERIFY_RETRY = 300  # 凭据验证失败后重新验证的间隔（秒）
+    MEDIA_ID_TTL = 86400  # 上传响应中没有过期时间时 media_id 的有效期（秒）
+    MEDIA_EXPIRY_MARGIN = 600  # media_id 提前失效的余量（秒）
+    MEDIA_CACHE_SIZE = 512  # 最多缓存的 media_id 数量
+    
+    # 凭据验证结果在所有实例间共享：(api_key, access_token) -> (验证时间, 失败时的异常)
+    _verify_cache: Dict[tuple, tuple] = {}
+    _verify_pending: Dict[tuple, Future] = {}
+    _verify_lock = threading.Lock()
+    
     def __init__(self):
         self.clients: Dict[str, tweepy.API] = {}
         self.active_client: Optional[tweepy.API] = None
+        self.active_username: Optional[str] = None
+        self._credentials: Dict[str, tuple] = {}
+        # 已上传媒体的缓存：(账号, 内容摘要) -> (media_id, 失效时间)
+        self._media_cache: Dict[tuple, tuple] = {}
+        self._media_lock = threading.Lock()
+        # tweepy 的接口都是阻塞的，放到线程池中执行；每个账号一个发送队列
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        # 各账号的频率额度 (剩余次数, 窗口重置时间) 和积压状态
+        self._quota: Dict[str, tuple] = {}
+        self._spilled: Dict[str, bool] = {}
+        self._drain_handles: Dict[str, asyncio.TimerHandle] = {}
+        self.spool_dir = Path(settings.config.data_dir) / 'tweet_queue'
+        # 图片在进程池中压缩到Twitter的限制以内
+        self.preprocessor = ImagePreprocessor()
         self._load_accounts()
         
     def _load_accounts(self):
@@ -31,63 +131,312 @@ class TwitterManager:
             
     def add_client(self, username: str, api_key: str, api_secret: str,
                   access_token: str, access_secret: str) -> tweepy.API:
-        """添加新的客户端"""
+        """添加新的客户端
+        
+        不在这里阻塞验证凭据，而是交给后台线程并发验证，
+        验证失败在第一次使用该账号发送推文时抛出。
+        """
         try:
             # 创建认证对象
             auth = tweepy.OAuthHandler(api_key, api_secret)
             auth.set_access_token(access_token, access_secret)
             
-            # 创建API对象
-            api = tweepy.API(auth, wait_on_rate_limit=True)
-            
-            # 验证凭据
-            api.verify_credentials()
+            # 创建API对象，频率限制由发送队列处理，不在接口内部阻塞等待
+            api = tweepy.API(auth, wait_on_rate_limit=False)
             
             self.clients[username] = api
+            self._credentials[username] = (api_key, access_token)
+            
+            # 后台验证凭据
+            self._start_verification(username)
             return api
         except Exception as e:
             logger.error(f"添加Twitter客户端失败: {str(e)}")
             raise
             
+    def _start_verification(self, username: str) -> Optional[Future]:
+        """在后台验证账号凭据，缓存仍有效时返回 None，同一凭据的并发验证只执行一次"""
+        key = self._credentials[username]
+        with self._verify_lock:
+            cached = self._verify_cache.get(key)
+            if cached:
+                checked_at, error = cached
+                ttl = self.VERIFY_TTL if error is None else self.VERIFY_RETRY
+                if time.time() - checked_at < ttl:
+                    return None
+                    
+            future = self._verify_pending.get(key)
+            if future is None:
+                future = self._get_executor().submit(self._verify_credentials, key, self.clients[username])
+                self._verify_pending[key] = future
+            return future
+            
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """获取线程池，关闭后再次使用时重新创建"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.MAX_WORKERS,
+                                                    thread_name_prefix='twitter')
+            return self._executor
+            
+    def _verify_credentials(self, key: tuple, api: tweepy.API):
+        """验证凭据并缓存结果，在线程池中执行"""
+        error = None
+        try:
+            api.verify_credentials()
+        except Exception as e:
+            error = e
+            logger.warning(f"Twitter账号凭据验证失败: {str(e)}")
+            
+        with self._verify_lock:
+            self._verify_cache[key] = (time.time(), error)
+            self._verify_pending.pop(key, None)
+            
+    async def _ensure_verified(self, username: str):
+        """等待账号凭据验证完成，验证失败时抛出验证时的异常"""
+        future = self._start_verification(username)
+        if future is not None:
+            await asyncio.wrap_future(future)
+        _, error = self._verify_cache[self._credentials[username]]
+        if error is not None:
+            raise error
+            
     def set_active_client(self, username: str) -> bool:
         """设置活动客户端"""
         if username in self.clients:
             self.active_client = self.clients[username]
+            self.active_username = username
             return True
         return False
         
-    async def send_tweet(self, text: str, media_paths: List[str] = None) -> bool:
-        """发送推文"""
-        if not self.active_client:
+    async def send_tweet(self, text: str, media: List[TweetMedia] = None,
+                         username: str = None, rule: dict = None) -> bool:
+        """发送推文
+        
+        推文进入账号自己的发送队列，由线程池调用 tweepy 的阻塞接口，
+        不占用事件循环。账号的频率额度用完后，推文转入数据库中的待发送队列，
+        窗口重置后按顺序补发，此时返回 True 表示推文已被接收。
+        rule 为推文所属的转发规则，补发失败时错误日志记录到该规则。
+        """
+        username = username or self.active_username
+        if not username:
             raise ValueError("没有活动的客户端")
+        if username not in self.clients:
+            raise ValueError(f"Twitter账号 {username} 未找到")
             
-        try:
-            # 处理文本长度
-            if len(text) > 280:
-                text = text[:277] + "..."
+        # 处理文本长度
+        if len(text) > 280:
+            text = text[:277] + "..."
+            
+        # 压缩超出限制的图片，Twitter限制最多4个媒体文件
+        media = [await self.preprocessor.prepare(item) for item in (media or [])[:4]]
+        
+        future = asyncio.get_running_loop().create_future()
+        self._get_queue(username).put_nowait((text, media, rule, future))
+        return await future
+        
+    def resume_spilled(self):
+        """为上次运行时未发送完的推文安排补发"""
+        for username in settings.db.get_queued_tweet_accounts():
+            if username in self.clients:
+                self._spilled[username] = True
+                self._get_queue(username).put_nowait(None)
                 
-            media_ids = []
-            # 上传媒体文件
-            if media_paths:
-                for media_path in media_paths[:4]:  # Twitter限制最多4个媒体文件
-                    media = self.active_client.media_upload(media_path)
-                    media_ids.append(media.media_id)
+    def _get_queue(self, username: str) -> asyncio.Queue:
+        """获取账号的发送队列，首次使用时启动队列的处理任务"""
+        if username not in self._queues:
+            self._queues[username] = asyncio.Queue()
+            self._workers[username] = asyncio.create_task(self._account_worker(username))
+        return self._queues[username]
+        
+    async def _account_worker(self, username: str):
+        """按顺序处理账号队列
+        
+        队列中的 None 表示频率窗口已重置，需要先补发数据库中积压的推文。
+        存在积压时新推文也进入积压队列，保证发送顺序。
+        """
+        queue = self._queues[username]
+        while True:
+            job = await queue.get()
+            try:
+                if job is None:
+                    try:
+                        await self._drain_spilled(username)
+                    except Exception as e:
+                        # 补发出错（例如数据库被锁定）时稍后重试，不能让队列的处理任务退出
+                        logger.error(f"补发推文失败: {str(e)}")
+                        self._schedule_drain(username)
+                    continue
                     
-            # 发送推文
-            if media_ids:
-                self.active_client.update_status(
-                    status=text,
-                    media_ids=media_ids
-                )
-            else:
-                self.active_client.update_status(text)
+                text, media, rule, future = job
+                if future.done():
+                    continue
+                try:
+                    if self._spilled.get(username) or self._quota_exhausted(username):
+                        self._spill(username, text, media, rule)
+                    else:
+                        try:
+                            await self._post(username, text, media)
+                        except RateLimitError:
+                            self._spill(username, text, media, rule)
+                    if not future.done():
+                        future.set_result(True)
+                except asyncio.CancelledError:
+                    # 队列停止时取消正在处理的推文，等待它的调用方不会一直挂起
+                    future.cancel()
+                    raise
+                except Exception as e:
+                    logger.error(f"发送推文失败: {str(e)}")
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                queue.task_done()
                 
-            return True
+    async def _post(self, username: str, text: str, media: List[TweetMedia]):
+        """在线程池中发送推文，并根据响应头更新账号的剩余额度"""
+        await self._ensure_verified(username)
+        loop = asyncio.get_running_loop()
+        try:
+            headers = await loop.run_in_executor(
+                self._get_executor(), self._post_tweet, username, text, media
+            )
+        except RateLimitError as e:
+            headers = self._response_headers(e)
+            reset = headers.get('x-rate-limit-reset')
+            reset = float(reset) if reset else time.time() + self.RATE_LIMIT_WINDOW
+            # 重置时间已过去（时钟偏差或窗口刚好重置）时至少等待一段时间，避免立即重试
+            self._quota[username] = (0, max(reset, time.time() + self.RATE_LIMIT_MIN_BACKOFF))
+            logger.warning(f"Twitter账号 {username} 触发频率限制")
+            raise
             
-        except Exception as e:
-            logger.error(f"发送推文失败: {str(e)}")
+        remaining = headers.get('x-rate-limit-remaining')
+        reset = headers.get('x-rate-limit-reset')
+        if remaining is not None and reset is not None:
+            self._quota[username] = (int(remaining), float(reset))
+            
+    def _quota_exhausted(self, username: str) -> bool:
+        """账号在当前频率窗口内的额度是否已用完"""
+        remaining, reset = self._quota.get(username, (None, 0))
+        if time.time() >= reset:
+            self._quota.pop(username, None)
             return False
+        return remaining is not None and remaining <= 0
+        
+    def _spill(self, username: str, text: str, media: List[TweetMedia], rule: dict = None):
+        """将推文写入数据库积压队列，媒体保存到队列目录中"""
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        saved_paths = []
+        for item in media[:4]:
+            saved = self.spool_dir / f"{uuid.uuid4().hex}{os.path.splitext(item.name)[1]}"
+            item.save(str(saved))
+            saved_paths.append(str(saved))
             
+        settings.db.enqueue_tweet(username, text, saved_paths,
+                                  rule_id=rule['id'] if rule else None,
+                                  rule_name=rule['name'] if rule else None)
+        self._spilled[username] = True
+        self._schedule_drain(username)
+        logger.info(f"Twitter账号 {username} 额度已用完，推文已加入待发送队列")
+        
+    def _schedule_drain(self, username: str):
+        """在频率窗口重置时唤醒账号队列补发积压的推文"""
+        if username in self._drain_handles:
+            return
+        _, reset = self._quota.get(username, (None, time.time() + self.RATE_LIMIT_WINDOW))
+        delay = max(reset - time.time(), 1.0)
+        
+        def wake():
+            self._drain_handles.pop(username, None)
+            if username in self._queues:
+                self._queues[username].put_nowait(None)
+                
+        self._drain_handles[username] = asyncio.get_running_loop().call_later(delay, wake)
+        
+    async def _drain_spilled(self, username: str):
+        """按顺序补发积压的推文，额度再次用完时等待下一个窗口"""
+        while not self._quota_exhausted(username):
+            tweets = settings.db.get_queued_tweets(username)
+            if not tweets:
+                self._spilled[username] = False
+                return
+                
+            for tweet in tweets:
+                media = [TweetMedia.from_path(path) for path in tweet['media_paths']]
+                try:
+                    await self._post(username, tweet['text'], media)
+                except RateLimitError:
+                    break
+                except Exception as e:
+                    logger.error(f"补发推文失败: {str(e)}")
+                    settings.db.add_error_log("推文补发", str(e),
+                                              rule_id=tweet['rule_id'],
+                                              rule_name=tweet['rule_name'])
+                    
+                try:
+                    settings.db.delete_queued_tweet(tweet['id'])
+                finally:
+                    for item in media:
+                        item.cleanup()
+                        
+                if self._quota_exhausted(username):
+                    break
+                    
+        self._schedule_drain(username)
+        
+    def _post_tweet(self, username: str, text: str, media: List[TweetMedia]) -> Dict[str, str]:
+        """上传媒体并发送推文，在线程池中执行，返回发送推文的响应头"""
+        api = self.clients[username]
+        # 上传媒体文件，Twitter限制最多4个媒体文件
+        media_ids = [self._upload_media(username, api, item) for item in media[:4]]
+        
+        # 发送推文
+        if media_ids:
+            api.update_status(status=text, media_ids=media_ids)
+        else:
+            api.update_status(text)
+        return self._response_headers(api.last_response)
+        
+    def _upload_media(self, username: str, api: tweepy.API, item: TweetMedia) -> int:
+        """上传媒体并返回 media_id
+        
+        同一账号上传过的相同内容在 media_id 过期前直接复用。
+        每个账号的推文由自己的队列按顺序发送，同一账号不会同时上传相同的内容。
+        """
+        key = (username, item.digest())
+        with self._media_lock:
+            cached = self._media_cache.get(key)
+            if cached and cached[1] > time.time():
+                return cached[0]
+                
+        with item.open() as f:
+            uploaded = api.media_upload(
+                item.name,
+                file=f,
+                chunked=item.size > self.SIMPLE_UPLOAD_LIMIT
+            )
+        ttl = getattr(uploaded, 'expires_after_secs', None) or self.MEDIA_ID_TTL
+        with self._media_lock:
+            self._cache_media_id(key, uploaded.media_id,
+                                 time.time() + ttl - self.MEDIA_EXPIRY_MARGIN)
+        return uploaded.media_id
+        
+    def _cache_media_id(self, key: tuple, media_id: int, expires_at: float):
+        """缓存 media_id，超出容量时先清理过期的，再淘汰最早加入的"""
+        if len(self._media_cache) >= self.MEDIA_CACHE_SIZE:
+            now = time.time()
+            for expired in [k for k, (_, expiry) in self._media_cache.items() if expiry <= now]:
+                del self._media_cache[expired]
+            while len(self._media_cache) >= self.MEDIA_CACHE_SIZE:
+                del self._media_cache[next(iter(self._media_cache))]
+        self._media_cache[key] = (media_id, expires_at)
+        
+    @staticmethod
+    def _response_headers(source) -> Dict[str, str]:
+        """从响应或带响应的异常中取出小写键名的响应头"""
+        response = getattr(source, 'response', source)
+        headers = getattr(response, 'headers', None) or {}
+        return {key.lower(): value for key, value in headers.items()}
+        
     async def download_media(self, url: str) -> Optional[str]:
         """下载媒体文件"""
         try:
@@ -140,4 +489,31 @@ class TwitterManager:
         if username in self.clients:
             if self.active_client == self.clients[username]:
                 self.active_client = None
-            del self.clients[username]
\ No newline at end of file
+                self.active_username = None
+            del self.clients[username]
+            self._credentials.pop(username, None)
+            
+    async def close(self):
+        """停止所有发送队列，尚未发送的推文以取消结束，已积压的推文下次启动后补发"""
+        for handle in self._drain_handles.values():
+            handle.cancel()
+        for task in self._workers.values():
+            task.cancel()
+        for queue in self._queues.values():
+            while not queue.empty():
+                job = queue.get_nowait()
+                if job is not None:
+                    job[3].cancel()
+        self._drain_handles.clear()
+        self._workers.clear()
+        self._queues.clear()
+        self.preprocessor.shutdown()
+        # 取消线程池中尚未开始的任务，不等待正在执行的请求
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        with self._verify_lock:
+            for key, future in list(self._verify_pending.items()):
+                if future.cancelled():
+                    del self._verify_pending[key]
\ No newline at end of file
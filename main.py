@@ -2,6 +2,7 @@
 
 import sys
 import os
+import multiprocessing
 from qtpy.QtWidgets import QApplication
 from qtpy.QtCore import QCoreApplication
 from ui.main_window import MainWindow
@@ -32,4 +33,6 @@ def main():
     sys.exit(app.exec())
 
 if __name__ == "__main__":
+    # 打包后的程序启动图片预处理的子进程时需要
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
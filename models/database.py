@@ -2,65 +2,175 @@
 
 import sqlite3
 import json
+import atexit
+import gzip
 import logging
-from datetime import datetime
-from typing import List, Dict, Optional, Any
-from dataclasses import dataclass
+import os
+import re
+import shutil
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Dict, Optional, Any, Iterable, Iterator
 import threading
+import time
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
-@dataclass
-class Account:
-    id: int
-    type: str  # 'telegram' or 'twitter'
-    username: str
-    api_id: str
-    api_hash: str
-    access_token: Optional[str] = None
-    access_secret: Optional[str] = None
-    created_at: datetime = None
-    updated_at: datetime = None
+# 旧数据由 CURRENT_TIMESTAMP 写入 UTC 文本，换算为毫秒时间戳的表达式
+_LEGACY_TS_SQL = "CAST(ROUND((julianday(created_at) - 2440587.5) * 86400000) AS INTEGER)"
 
-@dataclass
-class Group:
-    id: int
-    group_id: str
-    title: str
-    type: str  # 'source' or 'target'
-    group_type: str  # 'channel' or 'group'
-    members_count: Optional[int] = None
-    created_at: datetime = None
-    updated_at: datetime = None
+def _now_ms() -> int:
+    """当前时间的毫秒时间戳"""
+    return int(time.time() * 1000)
 
-@dataclass
-class ForwardRule:
-    id: int
-    name: str
-    source_group_id: int
-    target_type: str  # 'telegram' or 'twitter'
-    target_id: int
-    filters: Dict
-    options: Dict
-    twitter_config: Optional[Dict] = None
-    is_enabled: bool = True
-    created_at: datetime = None
-    updated_at: datetime = None
+def _to_epoch_ms(value, upper: bool = False) -> Optional[int]:
+    """将日期、时间或其字符串形式转换为本地时区的毫秒时间戳
+    
+    纯日期作为上界时取次日零点，配合 < 比较构成半开区间
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value) if len(value) > 10 else date.fromisoformat(value)
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+        
+    day = datetime.combine(value, datetime.min.time())
+    if upper:
+        day += timedelta(days=1)
+    return int(day.timestamp() * 1000)
+
+def make_error_signature(error_type: str, message: Optional[str]) -> str:
+    """生成错误特征：异常类名加上去除了数字、字符串、链接等可变部分的消息模板"""
+    template = message or ''
+    template = re.sub(r'https?://\S+', '<url>', template)
+    # 引号外侧不能紧贴英文字母或数字，英文缩写和所有格中的撇号（can't、user's）不会被当作引号
+    template = re.sub(r'(?<![A-Za-z0-9])(?:\'[^\']*\'|"[^"]*")(?![A-Za-z0-9])', '<str>', template)
+    template = re.sub(r'0x[0-9a-fA-F]+', '<hex>', template)
+    template = re.sub(r'-?\d+(?:\.\d+)?', '<num>', template)
+    template = re.sub(r'\s+', ' ', template).strip()
+    return f"{error_type}: {template[:200]}" if template else error_type
 
-@dataclass
-class ForwardLog:
-    id: int
-    rule_id: int
-    message_text: str
-    status: str
-    error_message: Optional[str] = None
-    created_at: datetime = None
+def _parse_log_time(value) -> datetime:
+    """将日志时间转换为本地时间，兼容毫秒时间戳和旧的 UTC 文本"""
+    if isinstance(value, int):
+        return datetime.fromtimestamp(value / 1000)
+    utc_time = datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+    return utc_time.astimezone().replace(tzinfo=None)
+
+class _Lazy:
+    """延迟解析字段：保存数据库原始值，首次访问时才解析并缓存结果"""
+    def __init__(self, parser, raw_types: tuple = (str,)):
+        self.parser = parser
+        self.raw_types = raw_types
+        
+    def __set_name__(self, owner, name):
+        self.slot = f'_{name}'
+        
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        value = getattr(obj, self.slot)
+        if isinstance(value, self.raw_types):
+            value = self.parser(value)
+            setattr(obj, self.slot, value)
+        return value
+        
+    def __set__(self, obj, value):
+        setattr(obj, self.slot, value)
+
+class _Record:
+    """使用 __slots__ 的轻量记录类型，字段顺序由 _fields 定义"""
+    __slots__ = ()
+    _fields: tuple = ()
+    _defaults: dict = {}
+    
+    def __init__(self, *args, **kwargs):
+        if len(args) > len(self._fields):
+            raise TypeError(f"{type(self).__name__} 最多接受 {len(self._fields)} 个参数")
+        for name, value in zip(self._fields, args):
+            setattr(self, name, value)
+        for name in self._fields[len(args):]:
+            setattr(self, name, kwargs.pop(name, self._defaults.get(name)))
+        if kwargs:
+            raise TypeError(f"{type(self).__name__} 不支持的字段: {', '.join(kwargs)}")
+            
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self._fields)
+        return f'{type(self).__name__}({fields})'
+        
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self._fields)
+
+class Account(_Record):
+    __slots__ = ('id', 'type', 'username', 'api_id', 'api_hash',
+                 'access_token', 'access_secret', '_created_at', '_updated_at')
+    _fields = ('id', 'type', 'username', 'api_id', 'api_hash',
+               'access_token', 'access_secret', 'created_at', 'updated_at')
+    # type: 'telegram' or 'twitter'
+    created_at = _Lazy(datetime.fromisoformat)
+    updated_at = _Lazy(datetime.fromisoformat)
+
+class Group(_Record):
+    __slots__ = ('id', 'group_id', 'title', 'type', 'group_type',
+                 'members_count', '_created_at', '_updated_at')
+    _fields = ('id', 'group_id', 'title', 'type', 'group_type',
+               'members_count', 'created_at', 'updated_at')
+    # type: 'source' or 'target'; group_type: 'channel' or 'group'
+    created_at = _Lazy(datetime.fromisoformat)
+    updated_at = _Lazy(datetime.fromisoformat)
+
+class ForwardRule(_Record):
+    __slots__ = ('id', 'name', 'source_group_id', 'target_type', 'target_id',
+                 '_filters', '_options', '_twitter_config', 'is_enabled',
+                 '_created_at', '_updated_at')
+    _fields = ('id', 'name', 'source_group_id', 'target_type', 'target_id',
+               'filters', 'options', 'twitter_config', 'is_enabled',
+               'created_at', 'updated_at')
+    _defaults = {'is_enabled': True}
+    # target_type: 'telegram' or 'twitter'
+    filters = _Lazy(json.loads)
+    options = _Lazy(json.loads)
+    twitter_config = _Lazy(json.loads)
+    created_at = _Lazy(datetime.fromisoformat)
+    updated_at = _Lazy(datetime.fromisoformat)
+
+class ForwardLog(_Record):
+    __slots__ = ('id', 'rule_id', 'message_text', 'status',
+                 'error_message', '_created_at')
+    _fields = ('id', 'rule_id', 'message_text', 'status',
+               'error_message', 'created_at')
+    created_at = _Lazy(_parse_log_time, raw_types=(int, str))
 
 class DatabaseManager:
     _instance = None
     _lock = threading.Lock()
     
+    ERROR_LOG_CAPACITY = 10000  # 错误日志最多保留的条数
+    ERROR_FLUSH_SIZE = 50  # 错误日志缓冲达到该条数时立即写入
+    ERROR_FLUSH_INTERVAL = 2.0  # 错误日志缓冲的最长等待时间（秒）
+    
+    # 数据库结构迁移：(版本号, 方法名, 是否在后台执行)，只能在末尾追加
+    SCHEMA_MIGRATIONS = (
+        (1, '_create_tables', False),
+        (2, '_migrate_log_timestamps', False),
+        (3, '_migrate_error_signatures', False),
+        (4, '_compact_groups', False),
+        (5, '_compact_statistics', False),
+        (6, '_setup_full_text_search', False),
+        (7, '_backfill_log_timestamps', True),
+        (8, '_create_log_indexes', True),
+        (9, '_rebuild_full_text_index', True),
+        (10, '_create_tweet_queue', False),
+        (11, '_create_media_cache', False),
+        (12, '_create_entity_cache', False),
+        (13, '_migrate_tweet_queue_rules', False),
+    )
+    
     def __new__(cls, db_path: str = None):
         with cls._lock:
             if cls._instance is None:
@@ -70,12 +180,110 @@ class DatabaseManager:
     def __init__(self, db_path: str = None):
         if not hasattr(self, '_initialized'):
             self.db_path = db_path or str(Path.home() / '.tg_forward' / 'forward.db')
+            self.archive_dir = Path(self.db_path).parent / 'archive'
+            self.backup_dir = Path(self.db_path).parent / 'backups'
+            self._backup_lock = threading.Lock()
+            self._prune_lock = threading.Lock()
+            # 规则和群组的内存缓存，写操作递增版本号使其失效
+            self._cache_lock = threading.Lock()
+            self._cache_version = 0
+            self._cached_version = -1
+            self._rule_cache: Dict[int, ForwardRule] = {}
+            self._rule_name_index: Dict[str, int] = {}
+            self._group_cache: Dict[int, Group] = {}
+            self._group_external_index: Dict[tuple, int] = {}
+            self._ts_backfilled = False
+            self._fts_enabled = False
+            self._checked_archives = set()
+            # 错误日志写入缓冲
+            self._error_lock = threading.Lock()
+            self._error_buffer: List[tuple] = []
+            self._error_timer: Optional[threading.Timer] = None
+            self._error_suspended = False
+            # 恢复数据库期间阻止新建连接
+            self._restore_lock = threading.RLock()
+            atexit.register(self.flush_error_logs)
             self._initialized = True
-            self._create_tables()
+            self._initialize_schema()
+            
+    def _initialize_schema(self):
+        """执行尚未应用的结构迁移
+        
+        已应用的迁移记录在 schema_version 表中，结构已是最新时启动不执行任何DDL。
+        前台迁移按版本顺序同步执行；涉及大表的迁移（回填、建索引）在后台线程中
+        分批执行，完成后才记录版本，中途退出会在下次启动时继续。
+        迁移都可以重复执行，已完成一部分的迁移再次执行不会出错。
+        """
+        with self._get_connection() as conn:
+            # WAL 模式下读操作和在线备份不会阻塞转发引擎写入
+            conn.execute('PRAGMA journal_mode=WAL')
+            applied = self._get_applied_migrations(conn)
+            
+        pending = [m for m in self.SCHEMA_MIGRATIONS if m[0] not in applied]
+        if pending:
+            with self._get_connection() as conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        applied_ts INTEGER NOT NULL
+                    )
+                ''')
+            for version, name, background in pending:
+                if not background:
+                    getattr(self, name)()
+                    self._mark_migrated(version, name)
+                    logger.info(f"已应用数据库结构迁移 {version}: {name}")
+                    
+        done = {name for version, name, background in self.SCHEMA_MIGRATIONS
+                if version in applied or not background}
+        self._ts_backfilled = '_backfill_log_timestamps' in done
+        self._fts_enabled = '_rebuild_full_text_index' in done and self._has_table('forward_logs_fts')
+        
+        background = [m for m in pending if m[2]]
+        if background:
+            threading.Thread(target=self._run_background_migrations,
+                             args=(background,), daemon=True).start()
+            
+    def _run_background_migrations(self, migrations: List[tuple]):
+        """依次执行后台迁移，失败时停止，下次启动重试"""
+        for version, name, _ in migrations:
+            try:
+                getattr(self, name)()
+                self._mark_migrated(version, name)
+                logger.info(f"已应用数据库结构迁移 {version}: {name}")
+            except Exception as e:
+                logger.error(f"数据库结构迁移 {version}: {name} 失败: {str(e)}")
+                return
+                
+    def _get_applied_migrations(self, conn: sqlite3.Connection) -> set:
+        """已应用的迁移版本号"""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+        ).fetchone()
+        if not exists:
+            return set()
+        return {row[0] for row in conn.execute('SELECT version FROM schema_version')}
+        
+    def _mark_migrated(self, version: int, name: str):
+        """记录迁移已应用"""
+        with self._get_connection() as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO schema_version (version, name, applied_ts) VALUES (?, ?, ?)',
+                (version, name, _now_ms())
+            )
+            
+    def _has_table(self, name: str) -> bool:
+        """数据库中是否存在指定名称的表"""
+        with self._get_connection() as conn:
+            return conn.execute(
+                'SELECT 1 FROM sqlite_master WHERE name = ?', (name,)
+            ).fetchone() is not None
             
     def _get_connection(self) -> sqlite3.Connection:
-        """获取数据库连接"""
-        conn = sqlite3.connect(self.db_path)
+        """获取数据库连接，恢复数据库期间等待恢复完成"""
+        with self._restore_lock:
+            conn = sqlite3.connect(self.db_path)
         conn.row_factory = sqlite3.Row
         return conn
         
@@ -133,6 +341,9 @@ class DatabaseManager:
                     status TEXT NOT NULL,
                     error_message TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    created_ts INTEGER,
+                    error_type TEXT,
+                    error_signature TEXT,
                     FOREIGN KEY (rule_id) REFERENCES forward_rules (id)
                 );
                 
@@ -147,13 +358,24 @@ class DatabaseManager:
                     FOREIGN KEY (rule_id) REFERENCES forward_rules (id)
                 );
                 
+                -- 错误日志表（环形缓冲，只保留最近的记录）
+                CREATE TABLE IF NOT EXISTS error_logs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_ts INTEGER NOT NULL,
+                    rule_id INTEGER,
+                    rule_name TEXT,
+                    error_type TEXT NOT NULL,
+                    message TEXT
+                );
+                
                 -- 创建索引
                 CREATE INDEX IF NOT EXISTS idx_accounts_type ON accounts(type);
                 CREATE INDEX IF NOT EXISTS idx_groups_type ON groups(type);
                 CREATE INDEX IF NOT EXISTS idx_forward_rules_enabled ON forward_rules(is_enabled);
-                CREATE INDEX IF NOT EXISTS idx_forward_logs_rule_id ON forward_logs(rule_id);
-                CREATE INDEX IF NOT EXISTS idx_forward_logs_created_at ON forward_logs(created_at);
                 CREATE INDEX IF NOT EXISTS idx_statistics_date ON statistics(date);
+                CREATE INDEX IF NOT EXISTS idx_error_logs_created_ts ON error_logs(created_ts);
+                CREATE INDEX IF NOT EXISTS idx_error_logs_rule ON error_logs(rule_id, created_ts);
+                CREATE INDEX IF NOT EXISTS idx_error_logs_type ON error_logs(error_type, created_ts);
             ''')
             
     # Account 相关方法
@@ -202,15 +424,21 @@ class DatabaseManager:
     # Group 相关方法
     def save_group(self, group_id: str, title: str, type: str,
                   group_type: str, members_count: int = None) -> Group:
-        """保存群组信息"""
+        """保存群组信息，同一群组和类型已存在时更新原记录"""
         with self._get_connection() as conn:
             cursor = conn.execute('''
                 INSERT INTO groups (group_id, title, type, group_type, members_count)
                 VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (group_id, type) DO UPDATE SET
+                    title = excluded.title,
+                    group_type = excluded.group_type,
+                    members_count = COALESCE(excluded.members_count, groups.members_count),
+                    updated_at = CURRENT_TIMESTAMP
                 RETURNING *
             ''', (group_id, title, type, group_type, members_count))
             row = cursor.fetchone()
-            return self._row_to_group(row)
+        self._invalidate_cache()
+        return self._row_to_group(row)
             
     def get_groups(self, group_type: str = None) -> List[Group]:
         """获取群组列表"""
@@ -228,6 +456,52 @@ class DatabaseManager:
         """删除群组"""
         with self._get_connection() as conn:
             conn.execute('DELETE FROM groups WHERE id = ?', (group_id,))
+        self._invalidate_cache()
+            
+    def _compact_groups(self):
+        """合并重复的群组记录并建立 (group_id, type) 唯一索引
+        
+        旧版本每次保存规则都会插入新的群组行。每组重复记录保留最早的ID，
+        标题等信息取最近一次写入的值，转发规则改为指向保留的记录。
+        """
+        with self._get_connection() as conn:
+            duplicates = conn.execute('''
+                SELECT group_id, type, MIN(id) AS keep_id, MAX(id) AS latest_id
+                FROM groups GROUP BY group_id, type HAVING COUNT(*) > 1
+            ''').fetchall()
+            for row in duplicates:
+                keep_id = row['keep_id']
+                params = (row['group_id'], row['type'], keep_id)
+                conn.execute('''
+                    UPDATE groups SET
+                        (title, group_type, members_count, updated_at) = (
+                            SELECT title, group_type, members_count, updated_at
+                            FROM groups WHERE id = ?
+                        )
+                    WHERE id = ?
+                ''', (row['latest_id'], keep_id))
+                conn.execute('''
+                    UPDATE forward_rules SET source_group_id = ?
+                    WHERE source_group_id IN (
+                        SELECT id FROM groups WHERE group_id = ? AND type = ? AND id != ?
+                    )
+                ''', (keep_id,) + params)
+                conn.execute('''
+                    UPDATE forward_rules SET target_id = ?
+                    WHERE target_id IN (
+                        SELECT id FROM groups WHERE group_id = ? AND type = ? AND id != ?
+                    )
+                ''', (keep_id,) + params)
+                conn.execute(
+                    'DELETE FROM groups WHERE group_id = ? AND type = ? AND id != ?',
+                    params
+                )
+                
+            conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_groups_external ON groups(group_id, type)')
+            
+        if duplicates:
+            self._invalidate_cache()
+            logger.info(f"已合并 {len(duplicates)} 组重复的群组记录")
             
     # ForwardRule 相关方法
     def save_rule(self, name: str, source_group_id: int, target_type: str,
@@ -244,7 +518,8 @@ class DatabaseManager:
                  json.dumps(filters), json.dumps(options),
                  json.dumps(twitter_config) if twitter_config else None))
             row = cursor.fetchone()
-            return self._row_to_rule(row)
+        self._invalidate_cache()
+        return self._row_to_rule(row)
             
     def get_rules(self, enabled_only: bool = False) -> List[ForwardRule]:
         """获取转发规则列表"""
@@ -265,50 +540,947 @@ class DatabaseManager:
                 SET is_enabled = ?, updated_at = CURRENT_TIMESTAMP
                 WHERE id = ?
             ''', (is_enabled, rule_id))
+        self._invalidate_cache()
             
     def delete_rule(self, rule_id: int):
         """删除转发规则"""
         with self._get_connection() as conn:
             conn.execute('DELETE FROM forward_rules WHERE id = ?', (rule_id,))
+        self._invalidate_cache()
+            
+    def get_rule_views(self, enabled_only: bool = False) -> List[Dict]:
+        """一次联表查询获取规则及其源群组、目标信息"""
+        query = '''
+            SELECT r.*,
+                   s.group_id AS source_external_id,
+                   s.title AS source_title,
+                   s.group_type AS source_group_type,
+                   t.group_id AS target_external_id,
+                   t.title AS target_title
+            FROM forward_rules r
+            JOIN groups s ON s.id = r.source_group_id
+            JOIN groups t ON t.id = r.target_id
+        '''
+        if enabled_only:
+            query += ' WHERE r.is_enabled = 1'
+        query += ' ORDER BY r.id'
+        
+        with self._get_connection() as conn:
+            return [{
+                'rule': self._row_to_rule(row),
+                'source_group': {
+                    'id': row['source_external_id'],
+                    'title': row['source_title'],
+                    'type': row['source_group_type']
+                },
+                'target': {
+                    'id': row['target_external_id'],
+                    'title': row['target_title']
+                }
+            } for row in conn.execute(query)]
+            
+    # 缓存相关方法
+    def _invalidate_cache(self):
+        """规则或群组发生写入后使缓存失效"""
+        with self._cache_lock:
+            self._cache_version += 1
+            
+    def _ensure_cache(self):
+        """缓存版本落后时重新加载全部规则和群组"""
+        if self._cached_version == self._cache_version:
+            return
+            
+        with self._cache_lock:
+            version = self._cache_version
+            if self._cached_version == version:
+                return
+                
+            with self._get_connection() as conn:
+                rules = [self._row_to_rule(row) for row in conn.execute('SELECT * FROM forward_rules')]
+                groups = [self._row_to_group(row) for row in conn.execute('SELECT * FROM groups')]
+                
+            self._rule_cache = {rule.id: rule for rule in rules}
+            self._rule_name_index = {rule.name: rule.id for rule in rules}
+            self._group_cache = {group.id: group for group in groups}
+            self._group_external_index = {(group.group_id, group.type): group.id for group in groups}
+            self._cached_version = version
             
     # ForwardLog 相关方法
     def add_forward_log(self, rule_id: int, message_text: str,
-                       status: str, error_message: str = None) -> ForwardLog:
-        """添加转发日志"""
+                       status: str, error_message: str = None,
+                       error_type: str = None) -> ForwardLog:
+        """添加转发日志，失败的日志同时写入错误类型和错误特征"""
+        error_signature = None
+        if status == 'failed':
+            error_type = error_type or 'UnknownError'
+            error_signature = make_error_signature(error_type, error_message)
+        else:
+            error_type = None
+            
         with self._get_connection() as conn:
             cursor = conn.execute('''
-                INSERT INTO forward_logs (rule_id, message_text, status, error_message)
-                VALUES (?, ?, ?, ?)
+                INSERT INTO forward_logs (rule_id, message_text, status, error_message,
+                                          error_type, error_signature, created_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
                 RETURNING *
-            ''', (rule_id, message_text, status, error_message))
+            ''', (rule_id, message_text, status, error_message,
+                 error_type, error_signature, _now_ms()))
             row = cursor.fetchone()
             return self._row_to_log(row)
             
     def get_forward_logs(self, rule_id: int = None,
                         start_date: datetime = None,
-                        end_date: datetime = None) -> List[ForwardLog]:
-        """获取转发日志"""
+                        end_date: datetime = None,
+                        include_archive: bool = False) -> List[ForwardLog]:
+        """获取转发日志
+        
+        日期范围为半开区间 [start_date, end_date)，纯日期的 end_date 包含当天全天。
+        include_archive 为 True 时同时查询与日期范围重叠的月度归档库。
+        """
+        query, params = self._build_log_query(rule_id, start_date, end_date)
         with self._get_connection() as conn:
-            query = ['SELECT * FROM forward_logs']
-            params = []
+            logs = [self._row_to_log(row) for row in conn.execute(query, params)]
             
-            conditions = []
-            if rule_id:
-                conditions.append('rule_id = ?')
-                params.append(rule_id)
-            if start_date:
-                conditions.append('created_at >= ?')
-                params.append(start_date)
-            if end_date:
-                conditions.append('created_at <= ?')
-                params.append(end_date)
+        if include_archive:
+            query, params = self._build_log_query(
+                rule_id, start_date, end_date, ts_column='created_ts'
+            )
+            for archive_path in self._get_archive_paths(start_date, end_date):
+                archive = self._open_archive(archive_path)
+                try:
+                    logs.extend(self._row_to_log(row) for row in archive.execute(query, params))
+                finally:
+                    archive.close()
+            logs.sort(key=lambda log: log.created_at, reverse=True)
+            
+        return logs
+        
+    def iter_forward_logs(self, rule_id: int = None,
+                          start_date: datetime = None,
+                          end_date: datetime = None,
+                          include_archive: bool = False,
+                          chunk_size: int = 5000) -> Iterator[List[ForwardLog]]:
+        """按块流式读取转发日志，先归档库后主库，块内按 id 升序
+        
+        每块都是一次以 id 为游标续读的短查询，内存占用与总行数无关，
+        也不会在导出期间长时间持有读锁阻塞转发写入。
+        """
+        sources = self._get_archive_paths(start_date, end_date) if include_archive else []
+        sources.append(None)
+        
+        for archive_path in sources:
+            conditions, params = self._build_log_conditions(
+                rule_id, start_date, end_date,
+                ts_column='created_ts' if archive_path else None
+            )
+            conditions.append('id > ?')
+            query = f'''
+                SELECT * FROM forward_logs WHERE {' AND '.join(conditions)}
+                ORDER BY id LIMIT ?
+            '''
+            
+            last_id = 0
+            while True:
+                conn = self._open_archive(archive_path) if archive_path else self._get_connection()
+                try:
+                    rows = conn.execute(query, params + [last_id, chunk_size]).fetchall()
+                finally:
+                    conn.close()
+                    
+                if not rows:
+                    break
+                last_id = rows[-1]['id']
+                yield [self._row_to_log(row) for row in rows]
+                if len(rows) < chunk_size:
+                    break
+                    
+    def count_forward_logs(self, rule_id: int = None,
+                          start_date: datetime = None,
+                          end_date: datetime = None,
+                          include_archive: bool = False) -> Dict[str, int]:
+        """统计转发日志的总数和成功数，只做聚合查询不加载日志行"""
+        columns = "COUNT(*) AS total, COALESCE(SUM(status = 'success'), 0) AS success"
+        query, params = self._build_log_query(
+            rule_id, start_date, end_date, columns=columns, order=None
+        )
+        with self._get_connection() as conn:
+            row = conn.execute(query, params).fetchone()
+            counts = {'total': row['total'], 'success': row['success']}
+            
+        if include_archive:
+            query, params = self._build_log_query(
+                rule_id, start_date, end_date, columns=columns, order=None,
+                ts_column='created_ts'
+            )
+            for archive_path in self._get_archive_paths(start_date, end_date):
+                archive = self._open_archive(archive_path)
+                try:
+                    row = archive.execute(query, params).fetchone()
+                    counts['total'] += row['total']
+                    counts['success'] += row['success']
+                finally:
+                    archive.close()
+                    
+        return counts
+            
+    def _build_log_query(self, rule_id: int = None,
+                         start_date: datetime = None,
+                         end_date: datetime = None,
+                         columns: str = '*',
+                         order: Optional[str] = 'DESC',
+                         ts_column: str = None) -> tuple:
+        """构建转发日志查询语句，columns 指定只查询需要的列"""
+        ts_column = ts_column or self._log_ts_column
+        query = [f'SELECT {columns} FROM forward_logs']
+        conditions, params = self._build_log_conditions(rule_id, start_date, end_date, ts_column)
+        
+        if conditions:
+            query.append('WHERE ' + ' AND '.join(conditions))
+            
+        if order:
+            query.append(f'ORDER BY {ts_column} {order}')
+        return ' '.join(query), params
+        
+    def _build_log_conditions(self, rule_id: int = None,
+                              start_date: datetime = None,
+                              end_date: datetime = None,
+                              ts_column: str = None) -> tuple:
+        """构建转发日志的筛选条件"""
+        ts_column = ts_column or self._log_ts_column
+        conditions = []
+        params = []
+        if rule_id:
+            conditions.append('rule_id = ?')
+            params.append(rule_id)
+        if start_date:
+            conditions.append(f'{ts_column} >= ?')
+            params.append(_to_epoch_ms(start_date))
+        if end_date:
+            conditions.append(f'{ts_column} < ?')
+            params.append(_to_epoch_ms(end_date, upper=True))
+        return conditions, params
+        
+    @property
+    def _log_ts_column(self) -> str:
+        """日志时间戳列，回填完成前对未回填的旧行从 created_at 换算"""
+        return 'created_ts' if self._ts_backfilled else _LEGACY_TS_SQL
+        
+    def get_error_groups(self, rule_id: int = None,
+                         start_date: datetime = None,
+                         end_date: datetime = None,
+                         limit: int = 200) -> List[Dict]:
+        """按错误特征聚合失败的转发日志
+        
+        返回每个特征的次数、首次和最近出现时间以及涉及的规则ID，
+        查询只扫描失败行上的部分索引。
+        """
+        conditions, params = self._build_log_conditions(rule_id, start_date, end_date)
+        conditions.insert(0, "status = 'failed'")
+        query = f'''
+            SELECT error_signature, error_type, COUNT(*) AS count,
+                   MIN({self._log_ts_column}) AS first_ts,
+                   MAX({self._log_ts_column}) AS last_ts,
+                   GROUP_CONCAT(DISTINCT rule_id) AS rule_ids
+            FROM forward_logs
+            WHERE {' AND '.join(conditions)}
+            GROUP BY error_signature
+            ORDER BY count DESC
+            LIMIT ?
+        '''
+        with self._get_connection() as conn:
+            return [{
+                'signature': row['error_signature'],
+                'error_type': row['error_type'],
+                'count': row['count'],
+                'first_seen': _parse_log_time(row['first_ts']),
+                'last_seen': _parse_log_time(row['last_ts']),
+                'rule_ids': [int(i) for i in row['rule_ids'].split(',')] if row['rule_ids'] else []
+            } for row in conn.execute(query, params + [limit])]
+            
+    def _migrate_error_signatures(self):
+        """为 forward_logs 增加错误类型和错误特征列"""
+        with self._get_connection() as conn:
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(forward_logs)')}
+            if 'error_type' not in columns:
+                conn.execute('ALTER TABLE forward_logs ADD COLUMN error_type TEXT')
+            if 'error_signature' not in columns:
+                conn.execute('ALTER TABLE forward_logs ADD COLUMN error_signature TEXT')
+            
+    # 全文检索
+    def _setup_full_text_search(self):
+        """创建转发日志的 FTS5 全文索引，并用触发器与 forward_logs 保持同步"""
+        try:
+            with self._get_connection() as conn:
+                exists = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name = 'forward_logs_fts'"
+                ).fetchone()
+                if not exists:
+                    # trigram 分词支持中文等无空格文本的子串检索，旧版 SQLite 退回默认分词
+                    try:
+                        conn.execute('''
+                            CREATE VIRTUAL TABLE forward_logs_fts USING fts5(
+                                message_text, error_message,
+                                content='forward_logs', content_rowid='id',
+                                tokenize='trigram'
+                            )
+                        ''')
+                    except sqlite3.OperationalError:
+                        conn.execute('''
+                            CREATE VIRTUAL TABLE forward_logs_fts USING fts5(
+                                message_text, error_message,
+                                content='forward_logs', content_rowid='id'
+                            )
+                        ''')
+                conn.executescript('''
+                    CREATE TRIGGER IF NOT EXISTS forward_logs_fts_ai AFTER INSERT ON forward_logs BEGIN
+                        INSERT INTO forward_logs_fts (rowid, message_text, error_message)
+                        VALUES (new.id, new.message_text, new.error_message);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS forward_logs_fts_ad AFTER DELETE ON forward_logs BEGIN
+                        INSERT INTO forward_logs_fts (forward_logs_fts, rowid, message_text, error_message)
+                        VALUES ('delete', old.id, old.message_text, old.error_message);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS forward_logs_fts_au
+                    AFTER UPDATE OF message_text, error_message ON forward_logs BEGIN
+                        INSERT INTO forward_logs_fts (forward_logs_fts, rowid, message_text, error_message)
+                        VALUES ('delete', old.id, old.message_text, old.error_message);
+                        INSERT INTO forward_logs_fts (rowid, message_text, error_message)
+                        VALUES (new.id, new.message_text, new.error_message);
+                    END;
+                ''')
+        except sqlite3.OperationalError as e:
+            logger.warning(f"当前SQLite不支持FTS5，日志搜索将使用LIKE查询: {str(e)}")
+            
+    def _rebuild_full_text_index(self, batch_size: int = 2000, pause: float = 0.05):
+        """分批为已有日志建立全文索引，完成前搜索使用LIKE查询
+        
+        开始时在同一个写事务中清空索引并记录当前最大的日志ID，之后写入的日志由触发器索引，
+        不超过该ID的日志按ID区间分批补入，每批单独提交并记录进度，中途退出下次启动时继续。
+        """
+        if not self._has_table('forward_logs_fts'):
+            return
+            
+        with self._get_connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS fts_rebuild_progress (
+                    last_id INTEGER NOT NULL,
+                    max_id INTEGER NOT NULL
+                )
+            ''')
+            progress = conn.execute('SELECT last_id, max_id FROM fts_rebuild_progress').fetchone()
+            if progress is None:
+                conn.execute("INSERT INTO forward_logs_fts (forward_logs_fts) VALUES ('delete-all')")
+                max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM forward_logs').fetchone()[0]
+                conn.execute('INSERT INTO fts_rebuild_progress (last_id, max_id) VALUES (0, ?)', (max_id,))
+                progress = (0, max_id)
                 
-            if conditions:
-                query.append('WHERE ' + ' AND '.join(conditions))
+        last_id, max_id = progress
+        while last_id < max_id:
+            upper = min(last_id + batch_size, max_id)
+            with self._get_connection() as conn:
+                conn.execute('''
+                    INSERT INTO forward_logs_fts (rowid, message_text, error_message)
+                    SELECT id, message_text, error_message FROM forward_logs
+                    WHERE id > ? AND id <= ?
+                ''', (last_id, upper))
+                conn.execute('UPDATE fts_rebuild_progress SET last_id = ?', (upper,))
+            last_id = upper
+            time.sleep(pause)
+            
+        with self._get_connection() as conn:
+            conn.execute('DROP TABLE fts_rebuild_progress')
+        self._fts_enabled = True
+        
+    def search_forward_logs(self, keyword: str, rule_id: int = None,
+                            start_date: datetime = None,
+                            end_date: datetime = None,
+                            limit: int = 50, offset: int = 0) -> List[ForwardLog]:
+        """按消息内容或错误信息搜索转发日志，结果按相关度排序并分页
+        
+        仅检索主库中的日志，已归档的日志不在搜索范围内。
+        """
+        keyword = keyword.strip()
+        if not keyword:
+            return []
+            
+        conditions, params = self._build_log_conditions(rule_id, start_date, end_date)
+        
+        # trigram 索引只能匹配3个字符以上的关键词，过短时退回 LIKE 查询
+        if self._fts_enabled and len(keyword) >= 3:
+            phrase = '"' + keyword.replace('"', '""') + '"'
+            query = ['''
+                SELECT forward_logs.* FROM forward_logs_fts
+                JOIN forward_logs ON forward_logs.id = forward_logs_fts.rowid
+                WHERE forward_logs_fts MATCH ?
+            ''']
+            params.insert(0, phrase)
+            order = 'ORDER BY forward_logs_fts.rank'
+        else:
+            pattern = '%' + keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            query = ['''
+                SELECT * FROM forward_logs
+                WHERE (message_text LIKE ? ESCAPE '\\' OR error_message LIKE ? ESCAPE '\\')
+            ''']
+            params[:0] = [pattern, pattern]
+            order = f'ORDER BY {self._log_ts_column} DESC'
+            
+        for condition in conditions:
+            query.append(f'AND {condition}')
+        query.append(f'{order} LIMIT ? OFFSET ?')
+        params.extend([limit, offset])
+        
+        with self._get_connection() as conn:
+            return [self._row_to_log(row) for row in conn.execute(' '.join(query), params)]
+            
+    # 时间戳迁移
+    def _migrate_log_timestamps(self):
+        """为 forward_logs 增加毫秒时间戳列 created_ts，旧数据由后台迁移回填"""
+        with self._get_connection() as conn:
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(forward_logs)')}
+            if 'created_ts' not in columns:
+                conn.execute('ALTER TABLE forward_logs ADD COLUMN created_ts INTEGER')
+                
+    def _backfill_log_timestamps(self, batch_size: int = 1000, pause: float = 0.05):
+        """分批回填旧日志的 created_ts，每批单独提交以免阻塞写入
+        
+        created_ts 的索引在回填完成后才建立，按主键区间分批，每批只访问本区间的行。
+        新写入的日志自带 created_ts，只需处理开始时已存在的ID。
+        """
+        with self._get_connection() as conn:
+            max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM forward_logs').fetchone()[0]
+            
+        last_id = 0
+        while last_id < max_id:
+            upper = min(last_id + batch_size, max_id)
+            with self._get_connection() as conn:
+                cursor = conn.execute(f'''
+                    UPDATE forward_logs SET created_ts = {_LEGACY_TS_SQL}
+                    WHERE id > ? AND id <= ? AND created_ts IS NULL
+                ''', (last_id, upper))
+            last_id = upper
+            if cursor.rowcount:
+                time.sleep(pause)
+                
+        self._ts_backfilled = True
+        
+    def _create_log_indexes(self):
+        """时间戳回填完成后建立转发日志的索引，并删除按 created_at 的旧索引"""
+        with self._get_connection() as conn:
+            conn.executescript('''
+                CREATE INDEX IF NOT EXISTS idx_forward_logs_created_ts ON forward_logs(created_ts);
+                CREATE INDEX IF NOT EXISTS idx_forward_logs_rule_ts ON forward_logs(rule_id, created_ts);
+                CREATE INDEX IF NOT EXISTS idx_forward_logs_failed
+                ON forward_logs(created_ts, error_signature, error_type, rule_id)
+                WHERE status = 'failed';
+                DROP INDEX IF EXISTS idx_forward_logs_created_at;
+                DROP INDEX IF EXISTS idx_forward_logs_rule_id;
+            ''')
+            
+    # 日志保留与归档
+    def prune_forward_logs(self, retention_days: int = 30,
+                           batch_size: int = 500, pause: float = 0.05) -> int:
+        """将超出保留期的转发日志移入月度归档库
+        
+        每批只搬移 batch_size 行并立即提交，批次之间休眠 pause 秒，
+        避免长时间占用写锁阻塞转发引擎。返回归档的行数。
+        """
+        if not self._prune_lock.acquire(blocking=False):
+            return 0
+            
+        try:
+            # 时间戳回填完成前无法按索引定位过期数据，推迟到下次执行
+            if not self._ts_backfilled:
+                return 0
+            # 全文索引补建完成前删除日志，触发器会从索引中删除尚未索引的行，推迟到补建完成后执行
+            if not self._fts_enabled and self._has_table('forward_logs_fts'):
+                return 0
+                
+            cutoff = _now_ms() - retention_days * 86400000
+            archived = 0
+            
+            while True:
+                with self._get_connection() as conn:
+                    row = conn.execute(
+                        'SELECT MIN(created_ts) FROM forward_logs WHERE created_ts < ?',
+                        (cutoff,)
+                    ).fetchone()
+                if row[0] is None:
+                    break
+                    
+                # 每轮只处理最早的一个月，保证同一批数据落入同一个归档库
+                month = datetime.fromtimestamp(row[0] / 1000).strftime('%Y-%m')
+                month_end = _to_epoch_ms(self._next_month(month) + '-01')
+                archived += self._archive_month(month, min(cutoff, month_end),
+                                                month_end, batch_size, pause)
+                                                
+            if archived:
+                logger.info(f"已归档 {archived} 条转发日志")
+            return archived
+            
+        except Exception as e:
+            logger.error(f"归档转发日志失败: {str(e)}")
+            return 0
+        finally:
+            self._prune_lock.release()
+            
+    def _archive_month(self, month: str, upper: int, month_end: int,
+                       batch_size: int, pause: float) -> int:
+        """分批将指定月份中早于 upper 的日志搬移到归档库"""
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        archive_path = self.archive_dir / f'forward_logs_{month}.db'
+        moved = 0
+        
+        conn = self._get_connection()
+        try:
+            conn.execute('ATTACH DATABASE ? AS archive', (str(archive_path),))
+            self._ensure_archive_schema(conn, 'archive')
+            
+            while True:
+                ids = [row[0] for row in conn.execute(
+                    'SELECT id FROM main.forward_logs WHERE created_ts < ? ORDER BY id LIMIT ?',
+                    (upper, batch_size)
+                )]
+                if not ids:
+                    break
+                    
+                placeholders = ','.join('?' * len(ids))
+                conn.execute(f'''
+                    INSERT OR IGNORE INTO archive.forward_logs
+                        (id, rule_id, message_text, status, error_message,
+                         created_at, created_ts, error_type, error_signature)
+                    SELECT id, rule_id, message_text, status, error_message,
+                           created_at, created_ts, error_type, error_signature
+                    FROM main.forward_logs WHERE id IN ({placeholders})
+                ''', ids)
+                conn.execute(f'DELETE FROM main.forward_logs WHERE id IN ({placeholders})', ids)
+                conn.commit()
                 
-            query.append('ORDER BY created_at DESC')
-            cursor = conn.execute(' '.join(query), params)
-            return [self._row_to_log(row) for row in cursor.fetchall()]
+                moved += len(ids)
+                time.sleep(pause)
+                
+            conn.execute('DETACH DATABASE archive')
+        finally:
+            conn.close()
+            
+        # 整月归档完成后整理归档库，回收空间
+        if upper == month_end:
+            archive = sqlite3.connect(str(archive_path))
+            try:
+                archive.execute('VACUUM')
+            finally:
+                archive.close()
+                
+        return moved
+        
+    def _open_archive(self, archive_path: Path) -> sqlite3.Connection:
+        """打开归档库连接"""
+        conn = sqlite3.connect(str(archive_path))
+        conn.row_factory = sqlite3.Row
+        if archive_path not in self._checked_archives:
+            self._ensure_archive_schema(conn, 'main')
+            self._checked_archives.add(archive_path)
+        return conn
+        
+    def _ensure_archive_schema(self, conn: sqlite3.Connection, schema: str):
+        """创建归档表，并为旧版归档库补齐后来新增的列"""
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {schema}.forward_logs (
+                id INTEGER PRIMARY KEY,
+                rule_id INTEGER NOT NULL,
+                message_text TEXT NOT NULL,
+                status TEXT NOT NULL,
+                error_message TEXT,
+                created_at TIMESTAMP,
+                created_ts INTEGER,
+                error_type TEXT,
+                error_signature TEXT
+            )
+        ''')
+        columns = {row[1] for row in conn.execute(f'PRAGMA {schema}.table_info(forward_logs)')}
+        if 'created_ts' not in columns:
+            conn.execute(f'ALTER TABLE {schema}.forward_logs ADD COLUMN created_ts INTEGER')
+            conn.execute(f'UPDATE {schema}.forward_logs SET created_ts = {_LEGACY_TS_SQL}')
+        for column in ('error_type', 'error_signature'):
+            if column not in columns:
+                conn.execute(f'ALTER TABLE {schema}.forward_logs ADD COLUMN {column} TEXT')
+        conn.execute(f'DROP INDEX IF EXISTS {schema}.idx_forward_logs_created_at')
+        conn.execute(f'''
+            CREATE INDEX IF NOT EXISTS {schema}.idx_forward_logs_created_ts
+            ON forward_logs(created_ts)
+        ''')
+        conn.commit()
+        
+    def _get_archive_paths(self, start_date: datetime = None,
+                           end_date: datetime = None) -> List[Path]:
+        """获取与日期范围重叠的归档库路径"""
+        if not self.archive_dir.exists():
+            return []
+            
+        # 前后各放宽一天，避免时区换算导致月初月末的数据被漏掉
+        start_month = end_month = None
+        if start_date:
+            start_ms = _to_epoch_ms(start_date) - 86400000
+            start_month = datetime.fromtimestamp(start_ms / 1000).strftime('%Y-%m')
+        if end_date:
+            end_ms = _to_epoch_ms(end_date, upper=True) + 86400000
+            end_month = datetime.fromtimestamp(end_ms / 1000).strftime('%Y-%m')
+            
+        paths = []
+        for path in sorted(self.archive_dir.glob('forward_logs_*.db')):
+            month = path.stem[len('forward_logs_'):]
+            if start_month and month < start_month:
+                continue
+            if end_month and month > end_month:
+                continue
+            paths.append(path)
+        return paths
+        
+    @staticmethod
+    def _next_month(month: str) -> str:
+        """返回 'YYYY-MM' 格式月份的下一个月"""
+        year, mon = int(month[:4]), int(month[5:7])
+        year, mon = (year + 1, 1) if mon == 12 else (year, mon + 1)
+        return f'{year:04d}-{mon:02d}'
+        
+    # ErrorLog 相关方法
+    def add_error_log(self, error_type: str, message: str,
+                      rule_id: int = None, rule_name: str = None):
+        """记录错误日志
+        
+        错误先写入内存缓冲区，攒够一批或超过刷新间隔后批量写入数据库，
+        避免故障期间每条错误都执行一次数据库写入。
+        """
+        with self._error_lock:
+            self._error_buffer.append((_now_ms(), rule_id, rule_name, error_type, message))
+            if self._error_suspended:
+                # 恢复数据库期间只写入缓冲区，恢复完成后统一写入
+                flush_now = False
+            elif len(self._error_buffer) >= self.ERROR_FLUSH_SIZE:
+                flush_now = True
+            else:
+                flush_now = False
+                if self._error_timer is None:
+                    self._error_timer = threading.Timer(self.ERROR_FLUSH_INTERVAL, self.flush_error_logs)
+                    self._error_timer.daemon = True
+                    self._error_timer.start()
+                    
+        if flush_now:
+            self.flush_error_logs()
+            
+    def flush_error_logs(self):
+        """将缓冲区中的错误日志批量写入数据库，并裁剪超出容量的旧记录"""
+        with self._error_lock:
+            entries, self._error_buffer = self._error_buffer, []
+            if self._error_timer is not None:
+                self._error_timer.cancel()
+                self._error_timer = None
+                
+        if not entries:
+            return
+            
+        try:
+            with self._get_connection() as conn:
+                conn.executemany('''
+                    INSERT INTO error_logs (created_ts, rule_id, rule_name, error_type, message)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', entries)
+                # 按自增ID裁剪，只保留最近 ERROR_LOG_CAPACITY 条
+                conn.execute('''
+                    DELETE FROM error_logs
+                    WHERE id <= (SELECT MAX(id) FROM error_logs) - ?
+                ''', (self.ERROR_LOG_CAPACITY,))
+        except Exception as e:
+            logger.error(f"写入错误日志失败: {str(e)}")
+            
+    def get_error_logs(self, rule_id: int = None, error_type: str = None,
+                       start_date: datetime = None, end_date: datetime = None,
+                       limit: int = 100, offset: int = 0) -> List[Dict]:
+        """分页获取错误日志，按时间倒序"""
+        self.flush_error_logs()
+        conditions, params = self._build_error_conditions(rule_id, error_type, start_date, end_date)
+        query = 'SELECT * FROM error_logs'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY created_ts DESC LIMIT ? OFFSET ?'
+        
+        with self._get_connection() as conn:
+            return [{
+                'time': datetime.fromtimestamp(row['created_ts'] / 1000),
+                'rule_id': row['rule_id'],
+                'rule': row['rule_name'],
+                'type': row['error_type'],
+                'message': row['message']
+            } for row in conn.execute(query, params + [limit, offset])]
+            
+    def get_error_summary(self, group_by: str = 'error_type',
+                          start_date: datetime = None,
+                          end_date: datetime = None) -> List[Dict]:
+        """按错误类型或规则聚合错误日志，返回数量以及首次、最近出现时间"""
+        columns = {'error_type': 'error_type', 'rule': 'rule_id, rule_name'}
+        if group_by not in columns:
+            raise ValueError(f"不支持的聚合方式: {group_by}")
+            
+        self.flush_error_logs()
+        conditions, params = self._build_error_conditions(start_date=start_date, end_date=end_date)
+        query = f'''
+            SELECT {columns[group_by]}, COUNT(*) AS count,
+                   MIN(created_ts) AS first_ts, MAX(created_ts) AS last_ts
+            FROM error_logs
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            GROUP BY {columns[group_by]}
+            ORDER BY count DESC
+        '''
+        with self._get_connection() as conn:
+            result = []
+            for row in conn.execute(query, params):
+                item = dict(row)
+                item['first_seen'] = datetime.fromtimestamp(item.pop('first_ts') / 1000)
+                item['last_seen'] = datetime.fromtimestamp(item.pop('last_ts') / 1000)
+                result.append(item)
+            return result
+            
+    def _build_error_conditions(self, rule_id: int = None, error_type: str = None,
+                                start_date: datetime = None,
+                                end_date: datetime = None) -> tuple:
+        """构建错误日志的筛选条件"""
+        conditions = []
+        params = []
+        if rule_id:
+            conditions.append('rule_id = ?')
+            params.append(rule_id)
+        if error_type:
+            conditions.append('error_type = ?')
+            params.append(error_type)
+        if start_date:
+            conditions.append('created_ts >= ?')
+            params.append(_to_epoch_ms(start_date))
+        if end_date:
+            conditions.append('created_ts < ?')
+            params.append(_to_epoch_ms(end_date, upper=True))
+        return conditions, params
+        
+    # 推文发送队列
+    def _create_tweet_queue(self):
+        """创建推文发送队列表，保存因频率限制暂时无法发送的推文"""
+        with self._get_connection() as conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS tweet_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    media_paths TEXT,
+                    created_ts INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_tweet_queue_username ON tweet_queue(username, id);
+            ''')
+            
+    def _migrate_tweet_queue_rules(self):
+        """为 tweet_queue 增加规则ID和规则名称列，补发失败时记录到对应规则"""
+        with self._get_connection() as conn:
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(tweet_queue)')}
+            if 'rule_id' not in columns:
+                conn.execute('ALTER TABLE tweet_queue ADD COLUMN rule_id INTEGER')
+            if 'rule_name' not in columns:
+                conn.execute('ALTER TABLE tweet_queue ADD COLUMN rule_name TEXT')
+                
+    def enqueue_tweet(self, username: str, text: str, media_paths: List[str] = None,
+                      rule_id: int = None, rule_name: str = None) -> int:
+        """将推文加入发送队列，返回队列ID"""
+        with self._get_connection() as conn:
+            cursor = conn.execute('''
+                INSERT INTO tweet_queue (username, text, media_paths, rule_id, rule_name, created_ts)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (username, text, json.dumps(media_paths or []), rule_id, rule_name, _now_ms()))
+            return cursor.lastrowid
+            
+    def get_queued_tweets(self, username: str, limit: int = 50) -> List[Dict]:
+        """按入队顺序获取账号待发送的推文"""
+        with self._get_connection() as conn:
+            return [{
+                'id': row['id'],
+                'text': row['text'],
+                'media_paths': json.loads(row['media_paths']) if row['media_paths'] else [],
+                'rule_id': row['rule_id'],
+                'rule_name': row['rule_name'],
+                'created_at': _parse_log_time(row['created_ts'])
+            } for row in conn.execute(
+                'SELECT * FROM tweet_queue WHERE username = ? ORDER BY id LIMIT ?',
+                (username, limit)
+            )]
+            
+    def get_queued_tweet_accounts(self) -> List[str]:
+        """有待发送推文的账号"""
+        with self._get_connection() as conn:
+            return [row[0] for row in conn.execute('SELECT DISTINCT username FROM tweet_queue')]
+            
+    def delete_queued_tweet(self, queue_id: int):
+        """从发送队列中删除推文"""
+        with self._get_connection() as conn:
+            conn.execute('DELETE FROM tweet_queue WHERE id = ?', (queue_id,))
+            
+    # 媒体缓存索引
+    def _create_media_cache(self):
+        """创建媒体缓存索引表，记录Telegram媒体与缓存文件内容摘要的对应关系"""
+        with self._get_connection() as conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS media_cache (
+                    media_key TEXT PRIMARY KEY,
+                    digest TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    name TEXT,
+                    created_ts INTEGER NOT NULL,
+                    last_used_ts INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_media_cache_digest ON media_cache(digest, last_used_ts);
+            ''')
+            
+    def get_cached_media(self, media_key: str) -> Optional[Dict]:
+        """查找媒体缓存记录，命中时更新最近使用时间"""
+        with self._get_connection() as conn:
+            row = conn.execute(
+                'UPDATE media_cache SET last_used_ts = ? WHERE media_key = ? RETURNING *',
+                (_now_ms(), media_key)
+            ).fetchone()
+            return {'digest': row['digest'], 'size': row['size'], 'name': row['name']} if row else None
+            
+    def add_cached_media(self, media_key: str, digest: str, size: int, name: str = None):
+        """添加媒体缓存记录"""
+        now = _now_ms()
+        with self._get_connection() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO media_cache
+                    (media_key, digest, size, name, created_ts, last_used_ts)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (media_key, digest, size, name, now, now))
+            
+    def get_media_cache_usage(self) -> int:
+        """缓存文件占用的总字节数，同一内容只计算一次"""
+        with self._get_connection() as conn:
+            return conn.execute('''
+                SELECT COALESCE(SUM(size), 0) FROM (
+                    SELECT MAX(size) AS size FROM media_cache GROUP BY digest
+                )
+            ''').fetchone()[0]
+            
+    def evict_cached_media(self, max_bytes: int, keep: Iterable[str] = ()) -> List[str]:
+        """按内容最近使用时间淘汰缓存记录，直到总大小不超过 max_bytes
+        
+        keep 中的内容正在使用，不会被淘汰。返回被淘汰的内容摘要，由调用方删除对应的文件。
+        """
+        with self._get_connection() as conn:
+            rows = conn.execute('''
+                SELECT digest, MAX(size) AS size, MAX(last_used_ts) AS last_used
+                FROM media_cache GROUP BY digest ORDER BY last_used
+            ''').fetchall()
+            usage = sum(row['size'] for row in rows)
+            evicted = []
+            for row in rows:
+                if usage <= max_bytes:
+                    break
+                if row['digest'] in keep:
+                    continue
+                conn.execute('DELETE FROM media_cache WHERE digest = ?', (row['digest'],))
+                usage -= row['size']
+                evicted.append(row['digest'])
+            return evicted
+            
+    def get_cached_media_digests(self) -> set:
+        """所有缓存记录引用的内容摘要"""
+        with self._get_connection() as conn:
+            return {row[0] for row in conn.execute('SELECT DISTINCT digest FROM media_cache')}
+            
+    def delete_cached_media(self, digest: str):
+        """删除引用指定内容的缓存记录"""
+        with self._get_connection() as conn:
+            conn.execute('DELETE FROM media_cache WHERE digest = ?', (digest,))
+            
+    # Telegram 实体缓存
+    def _create_entity_cache(self):
+        """创建Telegram实体缓存表，按账号保存对话的ID、access_hash、名称和成员数"""
+        with self._get_connection() as conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS telegram_entities (
+                    account TEXT NOT NULL,
+                    peer_id INTEGER NOT NULL,
+                    access_hash INTEGER,
+                    type TEXT NOT NULL,
+                    title TEXT,
+                    members_count INTEGER,
+                    last_message_ts INTEGER,
+                    updated_ts INTEGER NOT NULL,
+                    PRIMARY KEY (account, peer_id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_telegram_entities_dialogs
+                    ON telegram_entities(account, last_message_ts);
+            ''')
+            
+    def save_telegram_entities(self, account: str, entities: List[Dict]):
+        """保存或更新账号的实体缓存，未提供的名称、成员数和消息时间保留原值"""
+        now = _now_ms()
+        with self._get_connection() as conn:
+            conn.executemany('''
+                INSERT INTO telegram_entities
+                    (account, peer_id, access_hash, type, title, members_count, last_message_ts, updated_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (account, peer_id) DO UPDATE SET
+                    access_hash = excluded.access_hash,
+                    type = excluded.type,
+                    title = COALESCE(excluded.title, title),
+                    members_count = COALESCE(excluded.members_count, members_count),
+                    last_message_ts = COALESCE(excluded.last_message_ts, last_message_ts),
+                    updated_ts = excluded.updated_ts
+            ''', [(
+                account,
+                entity['peer_id'],
+                entity.get('access_hash'),
+                entity['type'],
+                entity.get('title'),
+                entity.get('members_count'),
+                entity.get('last_message_ts'),
+                now
+            ) for entity in entities])
+            
+    def get_telegram_entity(self, account: str, peer_id: int) -> Optional[Dict]:
+        """按对话ID查找账号的实体缓存"""
+        with self._get_connection() as conn:
+            row = conn.execute(
+                'SELECT * FROM telegram_entities WHERE account = ? AND peer_id = ?',
+                (account, peer_id)
+            ).fetchone()
+            return dict(row) if row else None
+            
+    def invalidate_telegram_entity(self, account: str, peer_id: int):
+        """清除失效的 access_hash，保留对话的名称等信息"""
+        with self._get_connection() as conn:
+            conn.execute(
+                'UPDATE telegram_entities SET access_hash = NULL WHERE account = ? AND peer_id = ?',
+                (account, peer_id)
+            )
+            
+    def get_telegram_dialogs(self, account: str) -> List[Dict]:
+        """账号缓存的群组和频道，按最近消息时间倒序"""
+        with self._get_connection() as conn:
+            return [dict(row) for row in conn.execute('''
+                SELECT * FROM telegram_entities
+                WHERE account = ? AND type IN ('channel', 'group') AND title IS NOT NULL
+                ORDER BY last_message_ts DESC
+            ''', (account,))]
+            
+    def get_dialog_sync_watermark(self, account: str) -> Optional[int]:
+        """账号已同步对话中最新的消息时间，用于增量同步"""
+        with self._get_connection() as conn:
+            return conn.execute(
+                'SELECT MAX(last_message_ts) FROM telegram_entities WHERE account = ?',
+                (account,)
+            ).fetchone()[0]
+            
+    def delete_stale_telegram_dialogs(self, account: str, synced_before: int):
+        """删除完整同步中没有出现的群组和频道（已退出或已解散）"""
+        with self._get_connection() as conn:
+            conn.execute('''
+                DELETE FROM telegram_entities
+                WHERE account = ? AND type IN ('channel', 'group') AND updated_ts < ?
+            ''', (account, synced_before))
             
     # Statistics 相关方法
     def update_statistics(self, rule_id: int, date: datetime,
@@ -326,6 +1498,16 @@ class DatabaseManager:
                     avg_delay = excluded.avg_delay
             ''', (rule_id, date, total_messages, success_messages, avg_delay))
             
+    def _compact_statistics(self):
+        """合并同一规则同一天的重复统计行并建立唯一索引，update_statistics 的 upsert 依赖该索引"""
+        with self._get_connection() as conn:
+            conn.executescript('''
+                DELETE FROM statistics WHERE id NOT IN (
+                    SELECT MAX(id) FROM statistics GROUP BY rule_id, date
+                );
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_statistics_rule_date ON statistics(rule_id, date);
+            ''')
+            
     def get_statistics(self, rule_id: int = None,
                       start_date: datetime = None,
                       end_date: datetime = None) -> List[Dict]:
@@ -351,7 +1533,7 @@ class DatabaseManager:
             query.append('ORDER BY date DESC')
             return [dict(row) for row in conn.execute(' '.join(query), params)]
             
-    # 数据转换方法
+    # 数据转换方法（时间和JSON字段保留原始值，由记录类型在访问时解析）
     def _row_to_account(self, row: sqlite3.Row) -> Account:
         return Account(
             id=row['id'],
@@ -361,8 +1543,8 @@ class DatabaseManager:
             api_hash=row['api_hash'],
             access_token=row['access_token'],
             access_secret=row['access_secret'],
-            created_at=datetime.fromisoformat(row['created_at']),
-            updated_at=datetime.fromisoformat(row['updated_at'])
+            created_at=row['created_at'],
+            updated_at=row['updated_at']
         )
         
     def _row_to_group(self, row: sqlite3.Row) -> Group:
@@ -373,8 +1555,8 @@ class DatabaseManager:
             type=row['type'],
             group_type=row['group_type'],
             members_count=row['members_count'],
-            created_at=datetime.fromisoformat(row['created_at']),
-            updated_at=datetime.fromisoformat(row['updated_at'])
+            created_at=row['created_at'],
+            updated_at=row['updated_at']
         )
         
     def _row_to_rule(self, row: sqlite3.Row) -> ForwardRule:
@@ -384,12 +1566,12 @@ class DatabaseManager:
             source_group_id=row['source_group_id'],
             target_type=row['target_type'],
             target_id=row['target_id'],
-            filters=json.loads(row['filters']),
-            options=json.loads(row['options']),
-            twitter_config=json.loads(row['twitter_config']) if row['twitter_config'] else None,
+            filters=row['filters'],
+            options=row['options'],
+            twitter_config=row['twitter_config'] or None,
             is_enabled=bool(row['is_enabled']),
-            created_at=datetime.fromisoformat(row['created_at']),
-            updated_at=datetime.fromisoformat(row['updated_at'])
+            created_at=row['created_at'],
+            updated_at=row['updated_at']
         )
         
     def _row_to_log(self, row: sqlite3.Row) -> ForwardLog:
@@ -399,24 +1581,158 @@ class DatabaseManager:
             message_text=row['message_text'],
             status=row['status'],
             error_message=row['error_message'],
-            created_at=datetime.fromisoformat(row['created_at'])
+            created_at=row['created_ts'] if row['created_ts'] is not None else row['created_at']
         )
         
     # 数据库备份和恢复
-    def backup_database(self, backup_path: str):
-        """备份数据库"""
-        with self._get_connection() as conn:
-            backup = sqlite3.connect(backup_path)
-            conn.backup(backup)
-            backup.close()
+    def backup_database(self, backup_path: str, compress: bool = False,
+                        pages: int = 256, pause: float = 0.02) -> str:
+        """在线备份数据库
+        
+        在只读事务中每次复制 pages 页，步骤之间休眠 pause 秒让出磁盘，
+        WAL 模式下转发引擎可以照常写入。复制完成后先做完整性检查，
+        compress 为 True 时输出 gzip 压缩文件。返回备份文件路径。
+        """
+        if compress and not backup_path.endswith('.gz'):
+            backup_path += '.gz'
+        raw_path = f"{backup_path}.part"
+        gz_path = f"{backup_path}.gz.part"
+        
+        try:
+            self._copy_database(raw_path, pages, pause)
+            self._verify_database(raw_path)
+            
+            if compress:
+                with open(raw_path, 'rb') as src, gzip.open(gz_path, 'wb', compresslevel=6) as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                os.replace(gz_path, backup_path)
+            else:
+                os.replace(raw_path, backup_path)
+            return backup_path
+        finally:
+            for path in (raw_path, gz_path):
+                if os.path.exists(path):
+                    os.remove(path)
+                    
+    def run_scheduled_backup(self, interval_hours: int = 24, keep: int = 7,
+                             compress: bool = True) -> Optional[str]:
+        """距上次备份超过 interval_hours 小时时执行备份，只保留最近 keep 份"""
+        if not self._backup_lock.acquire(blocking=False):
+            return None
+            
+        try:
+            backups = self.list_backups()
+            if backups and time.time() - backups[-1].stat().st_mtime < interval_hours * 3600:
+                return None
+                
+            self.backup_dir.mkdir(parents=True, exist_ok=True)
+            name = f"forward_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+            path = self.backup_database(str(self.backup_dir / name), compress=compress)
             
+            for old in self.list_backups()[:-keep]:
+                old.unlink()
+                
+            logger.info(f"数据库已备份到 {path}")
+            return path
+            
+        except Exception as e:
+            logger.error(f"定时备份数据库失败: {str(e)}")
+            return None
+        finally:
+            self._backup_lock.release()
+            
+    def list_backups(self) -> List[Path]:
+        """按时间从旧到新列出备份目录中的备份文件"""
+        if not self.backup_dir.exists():
+            return []
+        backups = list(self.backup_dir.glob('forward_*.db')) + list(self.backup_dir.glob('forward_*.db.gz'))
+        return sorted(backups, key=lambda path: path.name)
+        
     def restore_database(self, backup_path: str):
-        """从备份恢复数据库"""
-        backup = sqlite3.connect(backup_path)
-        with self._get_connection() as conn:
-            backup.backup(conn)
-        backup.close()
+        """从备份恢复数据库
+        
+        备份先解压或复制为临时文件并通过校验，再原子替换当前数据库，
+        任何一步失败都不会改动现有数据。
+        """
+        staged_path = f"{self.db_path}.restore"
+        try:
+            if backup_path.endswith('.gz'):
+                with gzip.open(backup_path, 'rb') as src, open(staged_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+            else:
+                shutil.copyfile(backup_path, staged_path)
+            self._verify_database(staged_path)
+            self._replace_database(staged_path)
+        finally:
+            if os.path.exists(staged_path):
+                os.remove(staged_path)
+                
+        logger.info(f"已从 {backup_path} 恢复数据库")
         
+    def _replace_database(self, staged_path: str):
+        """用校验过的数据库文件替换当前数据库
+        
+        替换期间阻止新建连接并暂停错误日志写入，等待其他连接的写事务结束后
+        将 WAL 写回主库，删除 -wal/-shm 文件再替换，旧的 WAL 不会被应用到恢复的数据库上。
+        """
+        with self._error_lock:
+            self._error_suspended = True
+            if self._error_timer is not None:
+                self._error_timer.cancel()
+                self._error_timer = None
+        try:
+            with self._restore_lock:
+                self.flush_error_logs()
+                conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+                try:
+                    # 取得排他锁，等待进行中的写事务结束
+                    conn.execute('BEGIN EXCLUSIVE')
+                    conn.execute('COMMIT')
+                    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                finally:
+                    conn.close()
+                for suffix in ('-wal', '-shm'):
+                    if os.path.exists(self.db_path + suffix):
+                        os.remove(self.db_path + suffix)
+                os.replace(staged_path, self.db_path)
+                
+                # 备份可能来自旧版本，补齐表结构并重新加载缓存
+                self._invalidate_cache()
+                self._initialize_schema()
+        finally:
+            with self._error_lock:
+                self._error_suspended = False
+            self.flush_error_logs()
+            
+    def _copy_database(self, target_path: str, pages: int, pause: float):
+        """分步复制当前数据库到 target_path"""
+        source = sqlite3.connect(self.db_path, isolation_level=None)
+        target = sqlite3.connect(target_path)
+        try:
+            # 整个复制过程持有同一个读事务，备份是一致的快照，
+            # 其他连接的写入不会让复制从头开始
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            source.backup(target, pages=pages,
+                          progress=lambda status, remaining, total: time.sleep(pause))
+            source.execute('COMMIT')
+            # 备份文件使用单文件日志模式，便于直接拷贝和压缩
+            target.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            target.close()
+            source.close()
+            
+    @staticmethod
+    def _verify_database(path: str):
+        """检查数据库文件的完整性"""
+        conn = sqlite3.connect(path)
+        try:
+            result = conn.execute('PRAGMA quick_check').fetchone()[0]
+        finally:
+            conn.close()
+        if result != 'ok':
+            raise sqlite3.DatabaseError(f"数据库校验失败: {result}")
+            
     # 数据迁移
     def migrate_from_qsettings(self, settings):
         """从QSettings迁移数据到SQLite"""
@@ -473,8 +1789,8 @@ class DatabaseManager:
             for rule_name in settings.settings.childKeys():
                 rule_data = settings.settings.value(rule_name)
                 # 需要先获取对应的group_id
-                source_group = self.get_group_by_external_id(rule_data['source_group']['id'])
-                target_group = self.get_group_by_external_id(rule_data['target']['id'])
+                source_group = self.get_group_by_external_id(rule_data['source_group']['id'], 'source')
+                target_group = self.get_group_by_external_id(rule_data['target']['id'], 'target')
                 
                 if source_group and target_group:
                     self.save_rule(
@@ -495,40 +1811,26 @@ class DatabaseManager:
             
     def get_rule_by_name(self, rule_name: str) -> Optional[ForwardRule]:
         """通过规则名称查找规则"""
-        with self._get_connection() as conn:
-            cursor = conn.execute(
-                'SELECT * FROM forward_rules WHERE name = ?',
-                (rule_name,)
-            )
-            row = cursor.fetchone()
-            return self._row_to_rule(row) if row else None
+        self._ensure_cache()
+        rule_id = self._rule_name_index.get(rule_name)
+        return self._rule_cache.get(rule_id) if rule_id is not None else None
             
     def get_group_by_id(self, group_id: int) -> Optional[Group]:
         """通过ID查找群组"""
-        with self._get_connection() as conn:
-            cursor = conn.execute(
-                'SELECT * FROM groups WHERE id = ?',
-                (group_id,)
-            )
-            row = cursor.fetchone()
-            return self._row_to_group(row) if row else None
+        self._ensure_cache()
+        return self._group_cache.get(group_id)
             
-    def get_group_by_external_id(self, external_id: str) -> Optional[Group]:
-        """通过外部ID查找群组"""
-        with self._get_connection() as conn:
-            cursor = conn.execute(
-                'SELECT * FROM groups WHERE group_id = ?',
-                (external_id,)
-            )
-            row = cursor.fetchone()
-            return self._row_to_group(row) if row else None
-
+    def get_group_by_external_id(self, external_id: str,
+                                 type: str = None) -> Optional[Group]:
+        """通过外部ID查找群组，未指定类型时优先返回源群组"""
+        self._ensure_cache()
+        for group_type in ((type,) if type else ('source', 'target')):
+            group_id = self._group_external_index.get((str(external_id), group_type))
+            if group_id is not None:
+                return self._group_cache.get(group_id)
+        return None
+        
     def get_rule_by_id(self, rule_id: int) -> Optional[ForwardRule]:
         """通过ID查找规则"""
-        with self._get_connection() as conn:
-            cursor = conn.execute(
-                'SELECT * FROM forward_rules WHERE id = ?',
-                (rule_id,)
-            )
-            row = cursor.fetchone()
-            return self._row_to_rule(row) if row else None
\ No newline at end of file
+        self._ensure_cache()
+        return self._rule_cache.get(rule_id)
\ No newline at end of file
@@ -9,7 +9,7 @@ from PyQt6.QtWidgets import (
 from PyQt6.QtCore import Qt, QThread, pyqtSignal
 from config.settings import settings
 from core.telegram import TelegramManager
-import asyncio
+from core.runner import runner
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,27 +19,26 @@ class LoadGroupsWorker(QThread):
     finished = pyqtSignal(list)
     error = pyqtSignal(str)
     
-    def __init__(self, telegram_manager):
+    def __init__(self, telegram_manager, full: bool = False):
         super().__init__()
         self.telegram_manager = telegram_manager
+        self.full = full
         
     def run(self):
         try:
-            # 创建新的事件循环
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            # 获取群组列表
-            groups = loop.run_until_complete(self.telegram_manager.get_dialogs())
+            # 在共用的事件循环中同步群组列表
+            groups = runner.run(self.telegram_manager.get_dialogs(full=self.full))
             self.finished.emit(groups)
         except Exception as e:
             self.error.emit(str(e))
-        finally:
-            loop.close()
 
 class GroupsWidget(QWidget):
     def __init__(self):
         super().__init__()
         self.telegram_manager = TelegramManager()
+        self.load_worker = None
+        # 同步进行中时收到的加载请求，None 表示没有，否则为是否完整同步
+        self.pending_full = None
         self.init_ui()
         
     def init_ui(self):
@@ -48,7 +47,7 @@ class GroupsWidget(QWidget):
         # 账号选择
         account_layout = QHBoxLayout()
         self.account_combo = QComboBox()
-        self.account_combo.addItems(self.telegram_manager.clients.keys())
+        self.account_combo.addItems(self.telegram_manager.accounts.keys())
         self.account_combo.currentTextChanged.connect(self.on_account_changed)
         account_layout.addWidget(QLabel("选择账号:"))
         account_layout.addWidget(self.account_combo)
@@ -56,7 +55,7 @@ class GroupsWidget(QWidget):
         
         # 刷新按钮
         refresh_btn = QPushButton("刷新群组列表")
-        refresh_btn.clicked.connect(self.load_groups)
+        refresh_btn.clicked.connect(lambda: self.load_groups(full=True))
         account_layout.addWidget(refresh_btn)
         
         layout.addLayout(account_layout)
@@ -71,23 +70,45 @@ class GroupsWidget(QWidget):
     def on_account_changed(self, phone):
         """切换当前账号"""
         if phone:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
             try:
-                loop.run_until_complete(self.telegram_manager.start_client(phone))
+                runner.run(self.telegram_manager.start_client(phone))
             except Exception as e:
                 QMessageBox.critical(self, "错误", f"切换账号失败: {str(e)}")
-            finally:
-                loop.close()
+                return
+                
+            # 先显示缓存的群组列表，再增量同步
+            self.load_groups(full=False)
 
-    def load_groups(self):
-        """加载群组列表"""
+    def load_groups(self, full: bool = True):
+        """加载群组列表，先显示缓存，再在后台同步
+        
+        full 为 True 时完整同步，能发现新加入的群组并清理已退出的群组和过期的名称。
+        """
         try:
-            groups = self.telegram_manager.get_dialogs()
-            self.update_groups(groups)
+            self.on_groups_loaded(self.telegram_manager.get_cached_dialogs())
+            
+            # 上一次同步仍在进行时记下请求，结束后再同步，不能替换掉仍在运行的线程
+            if self.load_worker is not None and self.load_worker.isRunning():
+                self.pending_full = bool(self.pending_full) or full
+                return
+                
+            self.load_worker = LoadGroupsWorker(self.telegram_manager, full=full)
+            self.load_worker.finished.connect(self.on_groups_loaded)
+            self.load_worker.error.connect(self.on_load_error)
+            self.load_worker.finished.connect(self.on_load_worker_done)
+            self.load_worker.error.connect(self.on_load_worker_done)
+            self.load_worker.start()
         except Exception as e:
             QMessageBox.critical(self, "错误", f"加载群组失败: {str(e)}")
-        
+            
+    def on_load_worker_done(self, *args):
+        """同步结束后执行期间收到的加载请求"""
+        # 信号在 run 返回前发出，等待线程真正结束
+        self.load_worker.wait()
+        if self.pending_full is not None:
+            full, self.pending_full = self.pending_full, None
+            self.load_groups(full=full)
+            
     def on_groups_loaded(self, groups):
         """群组加载完成的回调"""
         # 更新源群组和目标群组标签页
@@ -151,22 +172,16 @@ class SourceGroupsTab(QWidget):
             return
             
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            result = loop.run_until_complete(
-                self.telegram_manager.join_channel(link)
-            )
+            result = runner.run(self.telegram_manager.join_channel(link))
             if result:
                 QMessageBox.information(self, "成功", "成功加入群组")
                 self.group_link_input.clear()
-                # 重新加载群组列表
-                self.parent().parent().parent().load_groups()
+                # 新群组的最近消息可能早于上次同步，完整同步群组列表
+                self.parent().parent().parent().load_groups(full=True)
             else:
                 QMessageBox.warning(self, "失败", "加入群组失败")
         except Exception as e:
             QMessageBox.critical(self, "错误", f"加入群组失败: {str(e)}")
-        finally:
-            loop.close()
             
     def select_source(self, group):
         """选择源群组"""
@@ -1,14 +1,16 @@
 # ui/main_window.py
 
 import os
+import threading
 from qtpy.QtGui import QIcon
 from qtpy.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QLabel, QStackedWidget, QFrame, QApplication, QMessageBox
 )
-from qtpy.QtCore import Qt
+from qtpy.QtCore import Qt, QTimer
 from qt_material import apply_stylesheet
 
+from config.settings import settings
 from utils.common.common import resource_path
 
 from .accounts import AccountsWidget
@@ -53,6 +55,10 @@ class MainWindow(QMainWindow):
         
         # 初始化显示账号管理页面
         self.show_page(0)
+        
+        # 启动日志归档和自动备份任务
+        self.start_log_retention()
+        self.start_database_backup()
 
     def setup_theme(self):
         """设置应用程序主题"""
@@ -137,6 +143,28 @@ class MainWindow(QMainWindow):
         # 切换页面
         self.stack.setCurrentIndex(index)
         
+    def start_log_retention(self):
+        """定期归档过期的转发日志"""
+        self.retention_timer = QTimer(self)
+        self.retention_timer.timeout.connect(self.run_log_retention)
+        self.retention_timer.start(3600000)  # 每小时检查一次
+        QTimer.singleShot(60000, self.run_log_retention)  # 启动1分钟后先执行一次
+        
+    def run_log_retention(self):
+        """在后台线程中执行日志归档，避免阻塞界面"""
+        threading.Thread(target=settings.prune_forward_logs, daemon=True).start()
+        
+    def start_database_backup(self):
+        """定期检查是否需要自动备份数据库"""
+        self.backup_timer = QTimer(self)
+        self.backup_timer.timeout.connect(self.run_database_backup)
+        self.backup_timer.start(3600000)  # 每小时检查一次
+        QTimer.singleShot(300000, self.run_database_backup)  # 启动5分钟后先检查一次
+        
+    def run_database_backup(self):
+        """在后台线程中执行在线备份，避免阻塞界面"""
+        threading.Thread(target=settings.backup_database, daemon=True).start()
+        
     def closeEvent(self, event):
         """弹出确认对话框询问用户是否关闭程序"""
         reply = QMessageBox.question(
@@ -260,11 +260,8 @@ class RulesWidget(QWidget):
     def toggle_rule_status(self, rule):
         """切换规则状态"""
         try:
-            # 在数据库中查找规则
-            db_rule = settings.db.get_rule_by_name(rule['name'])
-            if db_rule:
-                settings.db.update_rule_status(db_rule.id, not rule.get('disabled', False))
-                self.load_rules()
+            settings.db.update_rule_status(rule['id'], not rule.get('disabled', False))
+            self.load_rules()
         except Exception as e:
             QMessageBox.critical(self, "错误", f"切换规则状态失败: {str(e)}")
             
@@ -278,10 +275,8 @@ class RulesWidget(QWidget):
                                    
         if reply == QMessageBox.StandardButton.Yes:
             try:
-                db_rule = settings.db.get_rule_by_name(rule['name'])
-                if db_rule:
-                    settings.db.delete_rule(db_rule.id)
-                    self.load_rules()
+                settings.db.delete_rule(rule['id'])
+                self.load_rules()
             except Exception as e:
                 QMessageBox.critical(self, "错误", f"删除规则失败: {str(e)}")
                 
@@ -4,13 +4,16 @@ from qtpy.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QGridLayout,
     QPushButton, QLabel, QFrame, QTabWidget,
     QTableWidget, QTableWidgetItem, QHeaderView,
-    QComboBox, QMessageBox
+    QComboBox, QMessageBox, QLineEdit,
+    QFileDialog, QInputDialog, QProgressDialog
 )
-from qtpy.QtCore import Qt, QTimer, QDate
+from qtpy.QtCore import Qt, QTimer, QDate, QThread, Signal
 from qtpy.QtGui import QColor
 import logging
+import os
 from datetime import datetime, timedelta
 from config.settings import settings
+from core.export import DataExporter, ExportCancelled
 from ui.widgets.date_picker import DatePicker
 
 logger = logging.getLogger(__name__)
@@ -77,7 +80,8 @@ class StatisticsWidget(QWidget):
         tab_widget = QTabWidget()
         
         # 转发记录标签页
-        tab_widget.addTab(ForwardLogsTab(), "转发记录")
+        self.logs_tab = ForwardLogsTab()
+        tab_widget.addTab(self.logs_tab, "转发记录")
         
         # 规则统计标签页
         tab_widget.addTab(RuleStatsTab(), "规则统计")
@@ -115,21 +119,20 @@ class StatisticsWidget(QWidget):
         """刷新统计数据"""
         try:
             # 获取总转发消息数
-            total_logs = settings.db.get_forward_logs()
-            self.total_messages.update_value(str(len(total_logs)))
+            total_counts = settings.db.count_forward_logs()
+            self.total_messages.update_value(str(total_counts['total']))
             
             # 计算今日转发数
             today = datetime.now().strftime('%Y-%m-%d')
-            today_logs = settings.db.get_forward_logs(
+            today_counts = settings.db.count_forward_logs(
                 start_date=today,
                 end_date=today
             )
-            self.today_messages.update_value(str(len(today_logs)))
+            self.today_messages.update_value(str(today_counts['total']))
             
             # 计算成功率
-            success_logs = [log for log in total_logs if log.status == 'success']
-            if total_logs:
-                success_rate = (len(success_logs) / len(total_logs)) * 100
+            if total_counts['total']:
+                success_rate = (total_counts['success'] / total_counts['total']) * 100
                 self.success_rate.update_value(f"{success_rate:.1f}%")
             
             # 获取活动规则数
@@ -144,13 +147,110 @@ class StatisticsWidget(QWidget):
             QMessageBox.critical(self, "错误", f"刷新统计数据失败: {str(e)}")
             
     def export_data(self):
-        """导出统计数据"""
-        # TODO: 实现数据导出功能
-        QMessageBox.information(self, "提示", "导出功能待实现")
+        """导出转发记录或统计数据"""
+        datasets = ["转发记录（按当前筛选条件）", "每日统计数据"]
+        dataset, ok = QInputDialog.getItem(self, "导出数据", "选择导出内容:", datasets, 0, False)
+        if not ok:
+            return
+            
+        formats = DataExporter.available_formats()
+        path, selected_filter = QFileDialog.getSaveFileName(
+            self, "导出数据", "", ";;".join(formats.values())
+        )
+        if not path:
+            return
+            
+        fmt = next(key for key, name in formats.items() if name == selected_filter)
+        if not os.path.splitext(path)[1]:
+            path = f"{path}.{fmt}"
+            
+        start_date = self.logs_tab.date_from.get_date().toString("yyyy-MM-dd")
+        end_date = self.logs_tab.date_to.get_date().toString("yyyy-MM-dd")
+        if dataset == datasets[0]:
+            options = {
+                'rule_id': self.logs_tab.rule_combo.currentData(),
+                'start_date': start_date,
+                'end_date': end_date
+            }
+        else:
+            options = {'start_date': start_date, 'end_date': end_date}
+            
+        self.export_progress = QProgressDialog("正在导出数据...", "取消", 0, 100, self)
+        self.export_progress.setWindowTitle("导出数据")
+        self.export_progress.setWindowModality(Qt.WindowModality.WindowModal)
+        self.export_progress.setMinimumDuration(0)
+        
+        self.export_worker = ExportWorker(
+            'logs' if dataset == datasets[0] else 'statistics',
+            path, fmt, options
+        )
+        self.export_worker.progress.connect(self.on_export_progress)
+        self.export_worker.finished.connect(self.on_export_finished)
+        self.export_worker.error.connect(self.on_export_error)
+        self.export_progress.canceled.connect(self.export_worker.cancel)
+        self.export_worker.start()
+        
+    def on_export_progress(self, done: int, total: int):
+        """更新导出进度"""
+        self.export_progress.setMaximum(total)
+        self.export_progress.setValue(done)
+        self.export_progress.setLabelText(f"正在导出数据... {done}/{total}")
+        
+    def on_export_finished(self, count: int, path: str):
+        """导出完成的回调"""
+        self.export_progress.reset()
+        QMessageBox.information(self, "成功", f"已导出 {count} 条数据到 {path}")
+        
+    def on_export_error(self, error_msg: str):
+        """导出失败的回调"""
+        self.export_progress.reset()
+        QMessageBox.critical(self, "错误", f"导出数据失败: {error_msg}")
+
+class ExportWorker(QThread):
+    """后台导出数据的工作线程"""
+    progress = Signal(int, int)
+    finished = Signal(int, str)
+    error = Signal(str)
+    
+    def __init__(self, dataset: str, path: str, fmt: str, options: dict):
+        super().__init__()
+        self.dataset = dataset
+        self.path = path
+        self.fmt = fmt
+        self.options = options
+        self.exporter = DataExporter()
+        self.cancelled = False
+        
+    def cancel(self):
+        """取消导出"""
+        self.cancelled = True
+        self.exporter.cancel()
+        
+    def run(self):
+        try:
+            if self.dataset == 'logs':
+                export = self.exporter.export_logs
+            else:
+                export = self.exporter.export_statistics
+            count = export(
+                self.path, self.fmt,
+                progress_callback=self.progress.emit,
+                **self.options
+            )
+            self.finished.emit(count, self.path)
+        except ExportCancelled:
+            logger.info("数据导出已取消")
+        except Exception as e:
+            logger.error(f"导出数据失败: {str(e)}")
+            if not self.cancelled:
+                self.error.emit(str(e))
 
 class ForwardLogsTab(QWidget):
+    PAGE_SIZE = 100  # 搜索结果每页条数
+    
     def __init__(self):
         super().__init__()
+        self.page = 0
         self.init_ui()
         self.load_logs()
         
@@ -207,7 +307,7 @@ class ForwardLogsTab(QWidget):
         self.rule_combo.addItem("所有规则")
         rules = settings.get_forward_rules()
         for rule in rules:
-            self.rule_combo.addItem(rule['name'])
+            self.rule_combo.addItem(rule['name'], rule['id'])
         rule_layout.addWidget(self.rule_combo)
         
         filter_layout.addLayout(rule_layout)
@@ -234,6 +334,19 @@ class ForwardLogsTab(QWidget):
         
         layout.addLayout(filter_layout)
         
+        # 全文搜索
+        search_layout = QHBoxLayout()
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("搜索消息内容或错误信息，留空显示全部")
+        self.search_input.returnPressed.connect(self.load_logs)
+        search_layout.addWidget(self.search_input)
+        
+        search_btn = QPushButton("搜索")
+        search_btn.clicked.connect(self.load_logs)
+        search_layout.addWidget(search_btn)
+        
+        layout.addLayout(search_layout)
+        
         # 日志表格
         self.table = QTableWidget()
         self.table.setColumnCount(6)
@@ -258,30 +371,77 @@ class ForwardLogsTab(QWidget):
         #     }
         # """)
         layout.addWidget(self.table)
+        
+        # 搜索结果分页
+        page_layout = QHBoxLayout()
+        page_layout.addStretch()
+        
+        self.prev_btn = QPushButton("上一页")
+        self.prev_btn.clicked.connect(self.prev_page)
+        page_layout.addWidget(self.prev_btn)
+        
+        self.page_label = QLabel()
+        page_layout.addWidget(self.page_label)
+        
+        self.next_btn = QPushButton("下一页")
+        self.next_btn.clicked.connect(self.next_page)
+        page_layout.addWidget(self.next_btn)
+        
+        layout.addLayout(page_layout)
 
     def load_logs(self):
         """加载转发日志"""
+        self.page = 0
+        self.show_page()
+        
+    def prev_page(self):
+        """搜索结果上一页"""
+        if self.page > 0:
+            self.page -= 1
+            self.show_page()
+            
+    def next_page(self):
+        """搜索结果下一页"""
+        self.page += 1
+        self.show_page()
+        
+    def show_page(self):
+        """按当前筛选条件和页码查询日志并更新表格"""
         try:
             # 获取筛选条件
             start_date = self.date_from.get_date().toString("yyyy-MM-dd")
             end_date = self.date_to.get_date().toString("yyyy-MM-dd")
-            rule_name = self.rule_combo.currentText()
+            rule_id = self.rule_combo.currentData()
+            keyword = self.search_input.text().strip()
             
-            # 从数据库获取日志
-            logs = []
-            if rule_name == "所有规则":
+            if keyword:
+                # 全文搜索，多取一条用于判断是否还有下一页
+                logs = settings.db.search_forward_logs(
+                    keyword,
+                    rule_id=rule_id,
+                    start_date=start_date,
+                    end_date=end_date,
+                    limit=self.PAGE_SIZE + 1,
+                    offset=self.page * self.PAGE_SIZE
+                )
+                has_next = len(logs) > self.PAGE_SIZE
+                logs = logs[:self.PAGE_SIZE]
+            else:
+                # 从数据库获取日志
                 logs = settings.get_forward_logs(
+                    rule_id=rule_id,
                     start_date=start_date,
                     end_date=end_date
                 )
-            else:
-                rule = settings.db.get_rule_by_name(rule_name)
-                if rule:
-                    logs = settings.get_forward_logs(
-                        rule_id=rule.id,
-                        start_date=start_date,
-                        end_date=end_date
-                    )
+                has_next = False
+                
+            # 更新分页控件
+            self.prev_btn.setVisible(bool(keyword))
+            self.next_btn.setVisible(bool(keyword))
+            self.page_label.setVisible(bool(keyword))
+            self.prev_btn.setEnabled(self.page > 0)
+            self.next_btn.setEnabled(has_next)
+            self.page_label.setText(f"第 {self.page + 1} 页")
             
             # 更新表格
             self.table.setRowCount(len(logs))
@@ -290,7 +450,7 @@ class ForwardLogsTab(QWidget):
                 time_item = QTableWidgetItem(log.created_at.strftime("%Y-%m-%d %H:%M:%S"))
                 self.table.setItem(i, 0, time_item)
                 
-                # 获取规则信息
+                # 获取规则信息（规则和群组均从内存缓存读取）
                 rule = settings.db.get_rule_by_id(log.rule_id)
                 if rule:
                     # 规则名
@@ -354,49 +514,49 @@ class RuleStatsTab(QWidget):
             self.table.setRowCount(len(rules))
             
             for i, rule in enumerate(rules):
-                # 获取规则的所有日志
-                db_rule = settings.db.get_rule_by_name(rule['name'])
-                if db_rule:
-                    logs = settings.db.get_forward_logs(rule_id=db_rule.id)
-                    
-                    # 获取今日日志
-                    today = datetime.now().strftime('%Y-%m-%d')
-                    today_logs = settings.db.get_forward_logs(
-                        rule_id=db_rule.id,
-                        start_date=today,
-                        end_date=today
-                    )
-                    
-                    # 计算统计数据
-                    total = len(logs)
-                    today_count = len(today_logs)
-                    success_count = len([log for log in logs if log.status == 'success'])
-                    success_rate = (success_count / total * 100) if total > 0 else 0
-                    
-                    self.table.setItem(i, 0, QTableWidgetItem(rule['name']))
-                    self.table.setItem(i, 1, QTableWidgetItem(str(total)))
-                    self.table.setItem(i, 2, QTableWidgetItem(str(today_count)))
-                    
-                    rate_item = QTableWidgetItem(f"{success_rate:.1f}%")
-                    if success_rate >= 90:
-                        rate_item.setBackground(QColor("#2ecc71"))
-                    elif success_rate >= 70:
-                        rate_item.setBackground(QColor("#f1c40f"))
-                    else:
-                        rate_item.setBackground(QColor("#e74c3c"))
-                    self.table.setItem(i, 3, rate_item)
-                    
-                    # TODO: 计算平均延迟
-                    self.table.setItem(i, 4, QTableWidgetItem("N/A"))
-                    
-                    status = "启用" if not rule.get('disabled') else "禁用"
-                    self.table.setItem(i, 5, QTableWidgetItem(status))
-                    
+                # 获取规则的日志计数
+                counts = settings.db.count_forward_logs(rule_id=rule['id'])
+                
+                # 获取今日日志计数
+                today = datetime.now().strftime('%Y-%m-%d')
+                today_counts = settings.db.count_forward_logs(
+                    rule_id=rule['id'],
+                    start_date=today,
+                    end_date=today
+                )
+                
+                # 计算统计数据
+                total = counts['total']
+                today_count = today_counts['total']
+                success_rate = (counts['success'] / total * 100) if total > 0 else 0
+                
+                self.table.setItem(i, 0, QTableWidgetItem(rule['name']))
+                self.table.setItem(i, 1, QTableWidgetItem(str(total)))
+                self.table.setItem(i, 2, QTableWidgetItem(str(today_count)))
+                
+                rate_item = QTableWidgetItem(f"{success_rate:.1f}%")
+                if success_rate >= 90:
+                    rate_item.setBackground(QColor("#2ecc71"))
+                elif success_rate >= 70:
+                    rate_item.setBackground(QColor("#f1c40f"))
+                else:
+                    rate_item.setBackground(QColor("#e74c3c"))
+                self.table.setItem(i, 3, rate_item)
+                
+                # TODO: 计算平均延迟
+                self.table.setItem(i, 4, QTableWidgetItem("N/A"))
+                
+                status = "启用" if not rule.get('disabled') else "禁用"
+                self.table.setItem(i, 5, QTableWidgetItem(status))
+                
         except Exception as e:
             logger.error(f"加载规则统计失败: {str(e)}")
             QMessageBox.critical(self, "错误", f"加载规则统计失败: {str(e)}")
 
 class ErrorLogsTab(QWidget):
+    """按错误特征聚合的失败日志视图"""
+    PERIODS = (("最近24小时", 1), ("最近7天", 7), ("最近30天", 30), ("全部", None))
+    
     def __init__(self):
         super().__init__()
         self.init_ui()
@@ -405,41 +565,69 @@ class ErrorLogsTab(QWidget):
     def init_ui(self):
         layout = QVBoxLayout(self)
         
-        # 错误日志表格
+        # 时间范围和规则筛选
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(QLabel("时间范围:"))
+        self.period_combo = QComboBox()
+        for label, days in self.PERIODS:
+            self.period_combo.addItem(label, days)
+        self.period_combo.setCurrentIndex(1)
+        filter_layout.addWidget(self.period_combo)
+        
+        filter_layout.addWidget(QLabel("规则:"))
+        self.rule_combo = QComboBox()
+        self.rule_combo.addItem("所有规则")
+        for rule in settings.get_forward_rules():
+            self.rule_combo.addItem(rule['name'], rule['id'])
+        filter_layout.addWidget(self.rule_combo)
+        
+        refresh_btn = QPushButton("刷新")
+        refresh_btn.clicked.connect(self.load_errors)
+        filter_layout.addWidget(refresh_btn)
+        filter_layout.addStretch()
+        layout.addLayout(filter_layout)
+        
+        # 错误聚合表格
         self.table = QTableWidget()
-        self.table.setColumnCount(4)
+        self.table.setColumnCount(6)
         self.table.setHorizontalHeaderLabels([
-            "时间", "规则", "错误类型", "错误信息"
+            "错误类型", "错误特征", "次数", "首次出现", "最近出现", "涉及规则"
         ])
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
         layout.addWidget(self.table)
         
     def load_errors(self):
-        """加载错误日志"""
+        """加载按错误特征聚合的失败日志"""
         try:
-            # 获取所有失败的转发记录
-            error_logs = settings.db.get_forward_logs()
-            error_logs = [log for log in error_logs if log.status == 'failed']
+            days = self.period_combo.currentData()
+            start_date = datetime.now() - timedelta(days=days) if days else None
             
-            self.table.setRowCount(len(error_logs))
-            for i, log in enumerate(error_logs):
-                # 时间
-                time_item = QTableWidgetItem(log.created_at.strftime("%Y-%m-%d %H:%M:%S"))
-                self.table.setItem(i, 0, time_item)
+            groups = settings.db.get_error_groups(
+                rule_id=self.rule_combo.currentData(),
+                start_date=start_date
+            )
+            
+            self.table.setRowCount(len(groups))
+            for i, group in enumerate(groups):
+                # 旧版本写入的失败日志没有错误特征
+                self.table.setItem(i, 0, QTableWidgetItem(group['error_type'] or "未知"))
+                self.table.setItem(i, 1, QTableWidgetItem(group['signature'] or "未知错误"))
                 
-                # 获取规则信息
-                rule = settings.db.get_rule_by_id(log.rule_id)
-                if rule:
-                    rule_item = QTableWidgetItem(rule.name)
-                    self.table.setItem(i, 1, rule_item)
+                count_item = QTableWidgetItem()
+                count_item.setData(Qt.ItemDataRole.DisplayRole, group['count'])
+                self.table.setItem(i, 2, count_item)
                 
-                # 错误类型和信息
-                error_msg = log.error_message or "未知错误"
-                error_type = "转发失败"  # 可以根据错误信息进一步分类
+                self.table.setItem(i, 3, QTableWidgetItem(
+                    group['first_seen'].strftime("%Y-%m-%d %H:%M:%S")))
+                self.table.setItem(i, 4, QTableWidgetItem(
+                    group['last_seen'].strftime("%Y-%m-%d %H:%M:%S")))
                 
-                self.table.setItem(i, 2, QTableWidgetItem(error_type))
-                self.table.setItem(i, 3, QTableWidgetItem(error_msg))
+                rule_names = []
+                for rule_id in group['rule_ids']:
+                    rule = settings.db.get_rule_by_id(rule_id)
+                    rule_names.append(rule.name if rule else f"#{rule_id}")
+                self.table.setItem(i, 5, QTableWidgetItem(", ".join(rule_names)))
             
         except Exception as e:
             logger.error(f"加载错误日志失败: {str(e)}")
-            QMessageBox.critical(self, "错误", f"加载错误日志失败: {str(e)}")
\ No newline at end of file
+            QMessageBox.critical(self, "错误", f"加载错误日志失败: {str(e)}")
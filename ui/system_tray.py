@@ -4,7 +4,7 @@ from qtpy.QtWidgets import QSystemTrayIcon, QMenu, QMessageBox
 from qtpy.QtGui import QIcon
 from qtpy.QtCore import Qt, QTimer
 from core.forward import ForwardEngine
-import asyncio
+from core.runner import runner
 import logging
 
 logger = logging.getLogger(__name__)
@@ -82,11 +82,8 @@ class SystemTrayIcon(QSystemTrayIcon):
     def start_forward(self):
         """开始转发"""
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            # 启动转发引擎
-            loop.run_until_complete(self.forward_engine.start())
+            # 启动转发引擎，引擎在共用的事件循环中持续运行
+            runner.run(self.forward_engine.start())
             
             self.running = True
             self.start_action.setEnabled(False)
@@ -113,11 +110,8 @@ class SystemTrayIcon(QSystemTrayIcon):
     def stop_forward(self):
         """停止转发"""
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
             # 停止转发引擎
-            loop.run_until_complete(self.forward_engine.stop())
+            runner.run(self.forward_engine.stop())
             
             self.running = False
             self.start_action.setEnabled(True)